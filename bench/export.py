@@ -0,0 +1,85 @@
+"""Export throughput benchmark
+
+Bulk loads customers into SQLite and reports rows per second and peak python
+memory for each export format.
+
+    python bench/export.py --rows 1000000 --batch-size 5000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import create_session
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(_here, '..'), os.path.join(_here, '..', 'test')]
+import models as m
+from sqlstrainer.strainer import Strainer
+from sqlstrainer.export import export, writers
+
+__author__ = 'Douglas MacDougall <douglas.macdougall@moesol.com>'
+
+VIEW = ['customer_id', 'first_name', 'last_name', 'dob', 'current_balance', 'parent.first_name']
+
+
+class NullStream(object):
+    """discards output so only fetching and encoding is measured"""
+
+    closed = False
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def load(engine, rows, chunk=10000):
+    m.Model.metadata.create_all(engine)
+    conn = engine.connect()
+    conn.execute(m.Parent.__table__.insert(),
+                 [dict(parent_id=i, first_name='parent%d' % i, last_name='p') for i in range(1, 101)])
+    for start in range(0, rows, chunk):
+        conn.execute(m.Customer.__table__.insert(), [
+            dict(parent_id=i % 100 + 1, first_name='first%d' % i, last_name='last%d' % i,
+                 current_balance=i % 1000, amount_of_last_deposit=0)
+            for i in range(start, min(rows, start + chunk))])
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--formats', nargs='*', default=sorted(writers))
+    args = parser.parse_args()
+
+    engine = create_engine('sqlite://')
+    load(engine, args.rows)
+    session = create_session(bind=engine)
+
+    strainer = Strainer(m.Customer)
+    strainer.relate('parent', [m.Customer.parent])
+    strained, _ = strainer.build([{'name': 'current_balance', 'action': 'ge', 'values': ['0']}])
+
+    for name in args.formats:
+        try:
+            writer = writers[name](NullStream())
+        except ImportError as e:
+            print('{0:6} skipped: {1}'.format(name, e))
+            continue
+        tracemalloc.start()
+        start = time.time()
+        count = export(session, strained, VIEW, writer, batch_size=args.batch_size)
+        elapsed = time.time() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('{0:6} {1:>9} rows {2:>12,.0f} rows/s  peak {3:,.1f} MiB'.format(
+            name, count, count / elapsed, peak / 2.0 ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Import time benchmark
+
+Runs ``python -X importtime -c "import sqlstrainer.strainer"`` a few times and
+reports the fastest self time of each module of the package and the slowest
+dependencies.  ``--check`` exits with status 1 when the package's own import
+time is over budget or a module that should load on first use was imported.
+
+    python bench/importtime.py
+    python bench/importtime.py --check
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_root = os.path.abspath(os.path.join(_here, '..'))
+
+__author__ = 'Douglas MacDougall <douglas.macdougall@moesol.com>'
+
+TARGET = 'sqlstrainer.strainer'
+
+"""milliseconds of self time allowed for all sqlstrainer modules together"""
+BUDGET_MS = 40
+
+"""loaded on first use of validation, matchers or thread pools, never on import"""
+LAZY = ('marshmallow', 'six', 'multiprocessing')
+
+
+def measure(module=TARGET, repeat=5):
+    """{module: (self us, cumulative us)}, fastest of `repeat` runs"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [_root, env.get('PYTHONPATH')]))
+    best = {}
+    for _ in range(repeat):
+        out = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                               env=env, stderr=subprocess.PIPE).communicate()[1]
+        for line in out.decode('utf-8').splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            own, cumulative, name = line[len('import time:'):].split('|')
+            name = name.strip()
+            timing = (int(own), int(cumulative))
+            if name not in best or timing < best[name]:
+                best[name] = timing
+    return best
+
+
+def check(timings):
+    """list of budget violations"""
+    problems = []
+    own = sum(t[0] for name, t in timings.items() if name.split('.')[0] == 'sqlstrainer') / 1000.0
+    if own > BUDGET_MS:
+        problems.append('sqlstrainer modules took {0:.1f} ms, budget {1} ms'.format(own, BUDGET_MS))
+    for name in timings:
+        if name.split('.')[0] in LAZY:
+            problems.append('{0} imported by {1}'.format(name, TARGET))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--check', action='store_true')
+    args = parser.parse_args()
+
+    timings = measure(repeat=args.repeat)
+    ours = sorted((t, name) for name, t in timings.items() if name.startswith('sqlstrainer'))
+    for (own, cumulative), name in reversed(ours):
+        print('{0:28} {1:8.1f} ms self {2:8.1f} ms cumulative'.format(name, own / 1000.0, cumulative / 1000.0))
+    print('slowest dependencies:')
+    top = sorted(((t[1], name) for name, t in timings.items()
+                  if '.' not in name and not name.startswith('sqlstrainer')), reverse=True)[:5]
+    for cumulative, name in top:
+        print('{0:28} {1:8.1f} ms cumulative'.format(name, cumulative / 1000.0))
+    problems = check(timings)
+    for problem in problems:
+        sys.stderr.write(problem + '\n')
+    if args.check and problems:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""Synthetic schema benchmark suite
+
+Generates a declarative schema of `depth` levels of `width` models, each model
+related to two models of the level above (both with backrefs), every
+`polymorphic`-th model with a joined table subclass.  Rows are bulk loaded into
+SQLite and the following are timed:
+
+* map: ``StrainerMap`` construction
+* shortest_path: root model to every model of the deepest level
+* relate: ``Strainer.relate`` of the deepest models
+* build: ``Strainer.build`` of a filter on the base and every relative
+* strain: ``StrainerFilter.strain``
+* compile: SQL compilation of the strained query
+* execute: running the strained query
+
+Results are written as JSON, ``--baseline`` compares them with an earlier run
+and exits with status 1 when an operation got slower than ``--tolerance``.
+
+    python bench/synthetic.py --width 50 --depth 4 --rows 2000 --output run.json
+    python bench/synthetic.py --width 50 --depth 4 --rows 2000 --baseline run.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import timeit
+import warnings
+
+import sqlalchemy as sa
+from sqlalchemy import orm
+from sqlalchemy.ext.declarative import declarative_base
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(_here, '..')]
+from sqlstrainer.mapper import StrainerMap
+from sqlstrainer.strainer import Strainer
+
+__author__ = 'Douglas MacDougall <douglas.macdougall@moesol.com>'
+
+
+def make_schema(width, depth, polymorphic=0):
+    """generates a declarative schema
+
+    :param width: models per level
+    :param depth: number of levels
+    :param polymorphic: every n-th model below the first level gets a joined table subclass, 0 for none
+    :return: (Base, levels) where levels is a list of lists of model classes
+    """
+    Base = declarative_base()
+    levels = []
+    count = 0
+    for d in range(depth):
+        level = []
+        for w in range(width):
+            name = 'T{0}_{1}'.format(d, w)
+            attrs = {
+                '__tablename__': name.lower(),
+                'id': sa.Column(sa.Integer, primary_key=True),
+                'name': sa.Column(sa.String(50)),
+                'value': sa.Column(sa.Integer),
+                'created': sa.Column(sa.Date),
+                'kind': sa.Column(sa.String(10)),
+            }
+            if d:
+                parent = levels[d - 1][w]
+                peer = levels[d - 1][(w + 1) % width]
+                attrs['parent_id'] = sa.Column(sa.Integer, sa.ForeignKey(parent.id), index=True)
+                attrs['peer_id'] = sa.Column(sa.Integer, sa.ForeignKey(peer.id))
+                attrs['parent'] = orm.relationship(parent, foreign_keys='{0}.parent_id'.format(name),
+                                                   backref='{0}_children'.format(name.lower()))
+                attrs['peer'] = orm.relationship(peer, foreign_keys='{0}.peer_id'.format(name),
+                                                 backref='{0}_peers'.format(name.lower()))
+            count += 1
+            sub = d and polymorphic and count % polymorphic == 0
+            if sub:
+                attrs['__mapper_args__'] = {'polymorphic_on': attrs['kind'], 'polymorphic_identity': 'base'}
+            model = type(name, (Base,), attrs)
+            if sub:
+                type(name + 'Sub', (model,), {
+                    '__tablename__': name.lower() + '_sub',
+                    'id': sa.Column(sa.Integer, sa.ForeignKey(model.id), primary_key=True),
+                    'extra': sa.Column(sa.String(50)),
+                    '__mapper_args__': {'polymorphic_identity': 'sub'},
+                })
+            level.append(model)
+        levels.append(level)
+    orm.configure_mappers()
+    return Base, levels
+
+
+def load(engine, Base, levels, rows, chunk=10000):
+    """bulk loads `rows` rows into every generated table"""
+    Base.metadata.create_all(engine)
+    rnd = random.Random(0)
+    conn = engine.connect()
+    for d, level in enumerate(levels):
+        for model in level:
+            table = model.__table__
+            subtables = [m.local_table for m in model.__mapper__.self_and_descendants if m.local_table is not table]
+            for start in range(0, rows, chunk):
+                batch = []
+                for i in range(start + 1, min(rows, start + chunk) + 1):
+                    row = dict(id=i, name='name{0}'.format(i), value=i % 1000,
+                               created=None, kind='sub' if subtables and i % 2 else 'base')
+                    if d:
+                        row['parent_id'] = rnd.randint(1, rows)
+                        row['peer_id'] = rnd.randint(1, rows)
+                    batch.append(row)
+                conn.execute(table.insert(), batch)
+                for sub in subtables:
+                    conn.execute(sub.insert(), [dict(id=r['id'], extra='x{0}'.format(r['id']))
+                                                for r in batch if r['kind'] == 'sub'])
+    conn.close()
+
+
+def best(func, number, repeat=3):
+    """fastest seconds per call"""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def run(args):
+    started = time.time()
+    Base, levels = make_schema(args.width, args.depth, args.polymorphic)
+    generate = time.time() - started
+    engine = sa.create_engine('sqlite://')
+    started = time.time()
+    load(engine, Base, levels, args.rows)
+    loaded = time.time() - started
+    session = orm.create_session(bind=engine)
+
+    root = levels[0][0]
+    leaves = levels[-1]
+    results = {}
+    results['map'] = best(lambda: StrainerMap.for_base(Base), 1)
+    dbmap = StrainerMap.for_base(Base)
+    reachable = [leaf for leaf in leaves if dbmap.shortest_path(root, leaf)]
+    results['shortest_path'] = best(lambda: [dbmap.shortest_path(root, leaf) for leaf in leaves], 1) / len(leaves)
+
+    relatives = reachable[:args.relatives]
+
+    def relate():
+        strainer = Strainer(root, dbmap=dbmap)
+        strainer.init()
+        for leaf in relatives:
+            strainer.relate(leaf.__tablename__, dbmap.shortest_path(root, leaf))
+        return strainer
+
+    results['relate'] = best(relate, 10) / max(len(relatives), 1)
+    strainer = relate()
+    data = [{'name': 'value', 'action': 'lt', 'values': [500]}]
+    data.extend({'name': leaf.__tablename__ + '.name', 'values': ['1']} for leaf in relatives)
+    strained, errors = strainer.build(data)
+    assert not errors, errors
+    query = strained.strain(session.query(root))
+    results['build'] = best(lambda: strainer.build(data), args.repeat)
+    results['strain'] = best(lambda: strained.strain(session.query(root)), args.repeat)
+    results['compile'] = best(lambda: str(strained.strain(session.query(root))), args.repeat)
+    results['execute'] = best(lambda: query.all(), 1)
+    return {
+        'params': vars(args),
+        'models': sum(len(list(model.__mapper__.self_and_descendants)) for level in levels for model in level),
+        'relatives': len(relatives),
+        'rows': len(query.all()),
+        'generate_seconds': generate,
+        'load_seconds': loaded,
+        'python': platform.python_version(),
+        'sqlalchemy': sa.__version__,
+        'results': results,
+    }
+
+
+def compare(current, baseline, tolerance):
+    """operations that got slower than `tolerance` (0.2 = 20%) compared to the baseline"""
+    slower = {}
+    for name, seconds in current['results'].items():
+        before = baseline['results'].get(name)
+        if before and seconds > before * (1 + tolerance):
+            slower[name] = seconds / before
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--width', type=int, default=20)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--polymorphic', type=int, default=5)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--relatives', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--output')
+    parser.add_argument('--baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    # relatives sharing their first hops make Query.join skip repeated joins
+    warnings.simplefilter('ignore', sa.exc.SAWarning)
+    current = run(args)
+    text = json.dumps(current, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(text + '\n')
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = compare(current, json.load(f), args.tolerance)
+        for name, ratio in sorted(slower.items()):
+            sys.stderr.write('{0:14} {1:.2f}x slower\n'.format(name, ratio))
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Filter validation microbenchmark
+
+Reports the per-entry cost of Strainer.build() and Strainer.build_many() for
+the compiled schema and the marshmallow StrainerSchema.
+
+    python bench/validate.py --entries 20 --repeat 2000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(_here, '..'), os.path.join(_here, '..', 'test')]
+import models as m
+from sqlstrainer.strainer import Strainer
+from sqlstrainer.schema import CompiledSchema, StrainerSchema
+
+__author__ = 'Douglas MacDougall <douglas.macdougall@moesol.com>'
+
+ENTRIES = [
+    {'name': 'first_name', 'values': ['b', 'c', 'd']},
+    {'name': 'customer_id', 'values': ['46'], 'action': 'gt'},
+    {'name': 'parent.first_name', 'values': ['b'], 'not_': True},
+    {'name': 'dob', 'action': 'empty'},
+    {'name': 'test', 'values': ['smith']},
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=1000)
+    args = parser.parse_args()
+
+    data = [ENTRIES[i % len(ENTRIES)] for i in range(args.entries)]
+    for schema in (CompiledSchema, StrainerSchema):
+        strainer = Strainer(m.Customer, schema=schema)
+        strainer.relate('parent', [m.Customer.parent])
+        strainer.build(data)
+        elapsed = min(timeit.repeat(lambda: strainer.build(data), number=args.repeat, repeat=3))
+        print('{0:16} {1:8.2f} us/entry'.format(
+            schema.__name__, elapsed / args.repeat / args.entries * 1e6))
+        elapsed = min(timeit.repeat(lambda: strainer.build_many([data] * args.repeat), number=1, repeat=3))
+        print('{0:16} {1:8.2f} us/entry build_many'.format(
+            schema.__name__, elapsed / args.repeat / args.entries * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,7 @@ SQLStrainer
 
 
 """
-from distutils.core import setup
+from setuptools import setup
 
 setup(
     name='SQLStrainer',
@@ -17,6 +17,10 @@ setup(
     description='Easily filter SQLAlchemy queries by any related property.',
     long_description=open('README.rst').read(),
     install_requires=[
-        "SQLAlchemy >= 0.8.0"
+        "SQLAlchemy >= 1.2"
     ],
+    extras_require={
+        # sqlstrainer.aio, aiosqlite runs its tests
+        'aio': ["SQLAlchemy >= 1.4", "aiosqlite"],
+    },
 )
\ No newline at end of file
@@ -27,6 +27,46 @@ match
 
 .. automodule:: sqlstrainer.match
 
+view
+----
+
+.. automodule:: sqlstrainer.view
+
+export
+------
+
+.. automodule:: sqlstrainer.export
+
+instrument
+----------
+
+.. automodule:: sqlstrainer.instrument
+
+advisor
+-------
+
+.. automodule:: sqlstrainer.advisor
+
+cost
+----
+
+.. automodule:: sqlstrainer.cost
+
+aio
+---
+
+.. automodule:: sqlstrainer.aio
+
+shard
+-----
+
+.. automodule:: sqlstrainer.shard
+
+diagnostics
+-----------
+
+.. automodule:: sqlstrainer.diagnostics
+
 """
 
 __author__ = 'Douglas MacDougall <douglas.macdougall@moesol.com>'
@@ -0,0 +1,21 @@
+"""Python 2/3 names used by the package, kept here so importing it does not need six"""
+import sys
+
+if sys.version_info[0] == 2:  # pragma: no cover
+    string_types = basestring,
+    text_type = unicode
+    unichr = unichr
+
+    def iteritems(d):
+        return d.iteritems()
+
+    import Queue as queue
+else:
+    string_types = str,
+    text_type = str
+    unichr = chr
+
+    def iteritems(d):
+        return iter(d.items())
+
+    import queue
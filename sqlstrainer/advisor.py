@@ -0,0 +1,239 @@
+"""Suggests indexes for the filters and joins a workload actually uses
+
+Record strained filters as they are served, then compare the columns they
+filter and join on with the indexes declared in the ``MetaData`` (or reported by
+the database catalog through an inspector).  Only the filter specs are looked
+at, no queries are sent to sample the data.
+
+.. code::
+
+    advisor = IndexAdvisor()
+
+    strained, errors = customer_strainer.build(request_data)
+    advisor.record(strained)
+    query = strained.strain(session.query(Customer))
+
+    for rec in advisor.report(dialect=engine.dialect):
+        print(rec.uses, rec.ddl or rec.reason)
+
+Recommendation kinds:
+
+* btree: comparisons, equality and the remote side of ``relate()`` joins
+* trigram: ``contains`` on strings for PostgreSQL (``gin_trgm_ops``)
+* lower: ``contains`` on strings elsewhere, ``ilike`` compiles to ``lower(column) LIKE``
+  so a ``lower()`` index is the closest a B-tree gets.  It is still scanned, not searched,
+  for a leading ``%``
+
+.. autoclass:: IndexAdvisor
+    :members:
+
+.. autoclass:: Recommendation
+"""
+import threading
+
+import sqlalchemy as sa
+from sqlalchemy.engine import default
+from sqlalchemy.orm.attributes import InstrumentedAttribute
+from sqlalchemy.orm.properties import ColumnProperty
+from sqlalchemy.sql.functions import FunctionElement
+
+__author__ = 'Douglas MacDougall <douglas.macdougall@moesol.com>'
+
+_SUBSTRING = ('contains', 'notcontains')
+
+
+class Recommendation(object):
+    """A missing index, ranked by the number of recorded uses"""
+    __slots__ = ('table', 'column', 'kind', 'actions', 'uses', 'ddl', 'reason')
+
+    def __init__(self, table, column, kind, actions, uses, ddl, reason):
+        self.table = table
+        self.column = column
+        self.kind = kind
+        self.actions = actions
+        self.uses = uses
+        self.ddl = ddl
+        self.reason = reason
+
+    def __repr__(self):
+        return '<Recommendation {0} {1}.{2} uses={3}>'.format(self.kind, self.table, self.column, self.uses)
+
+
+def _table_column(attr):
+    """the Table column behind a column attribute, None for hybrids and aggregates"""
+    if isinstance(attr, InstrumentedAttribute) and isinstance(attr.property, ColumnProperty):
+        column = attr.property.columns[0]
+        if isinstance(column, sa.Column) and column.table is not None:
+            return column
+    return None
+
+
+def _index_kind(column, action, dialect):
+    if action == 'join':
+        return 'btree'
+    if isinstance(column.type, sa.Boolean):
+        # too few distinct values for an index to pay off
+        return None
+    if action in _SUBSTRING:
+        if not isinstance(column.type, sa.String):
+            # cast(column as text) LIKE ... cannot use any index
+            return None
+        return 'trigram' if dialect.name == 'postgresql' else 'lower'
+    return 'btree'
+
+
+def _leading(expression):
+    """column an index expression starts with and whether it is lower(column)"""
+    if isinstance(expression, FunctionElement) and expression.name == 'lower':
+        columns = list(expression.clauses)
+        if len(columns) == 1 and isinstance(columns[0], sa.Column):
+            return columns[0], 'lower'
+        return None, None
+    if isinstance(expression, sa.Column):
+        return expression, 'btree'
+    return None, None
+
+
+def _metadata_indexes(table):
+    """{(column name, kind)} leading index entries declared on a Table"""
+    found = set()
+    for constraint in table.constraints:
+        if isinstance(constraint, (sa.PrimaryKeyConstraint, sa.UniqueConstraint)) and len(constraint.columns):
+            found.add((list(constraint.columns)[0].name, 'btree'))
+    for index in table.indexes:
+        expressions = list(index.expressions)
+        if not expressions:
+            continue
+        column, kind = _leading(expressions[0])
+        if column is None:
+            continue
+        using = index.dialect_options['postgresql'].get('using') or ''
+        if using.lower() in ('gin', 'gist'):
+            found.update((c.name, 'trigram') for c in index.columns)
+        else:
+            found.add((column.name, kind))
+    return found
+
+
+def _inspector_indexes(inspector, table):
+    """{(column name, kind)} leading index entries the database reports
+
+    Expression indexes are not reported by every dialect and are left out.
+    """
+    found = set()
+    pk = inspector.get_pk_constraint(table.name, schema=table.schema) or {}
+    if pk.get('constrained_columns'):
+        found.add((pk['constrained_columns'][0], 'btree'))
+    for index in inspector.get_indexes(table.name, schema=table.schema):
+        names = index.get('column_names') or []
+        if names and names[0] is not None:
+            found.add((names[0], 'btree'))
+    return found
+
+
+class IndexAdvisor(object):
+    """Records the (table, column, action) combinations that filters and joins use
+
+    Thread safe, one advisor can record every request of a process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._columns = {}
+        self._usage = {}
+
+    def _add(self, column, action):
+        key = (column.table.fullname, column.name)
+        self._columns[key] = column
+        actions = self._usage.setdefault(key, {})
+        actions[action] = actions.get(action, 0) + 1
+
+    def record(self, strained):
+        """records the columns a StrainerFilter filters and joins on
+
+        :param strained: StrainerFilter from :meth:`Strainer.build`
+        """
+        strainer = strained.strainer
+        used = []
+        relatives = set()
+        for f in strained.filters:
+            tbl, _ = strainer.split_name(f['name'])
+            column = _table_column(getattr(strainer.get(f['name']), 'column', None))
+            if column is not None:
+                used.append((column, f.get('action', 'contains')))
+            if tbl != strainer.tablename:
+                relatives.add(tbl)
+        for tbl in relatives:
+            for hop in strainer.relatives[tbl].join:
+                prop = getattr(hop, 'property', None)
+                for _, remote in getattr(prop, 'local_remote_pairs', ()):
+                    if isinstance(remote, sa.Column):
+                        used.append((remote, 'join'))
+        with self._lock:
+            for column, action in used:
+                self._add(column, action)
+
+    def usage(self):
+        """{(table, column): {action: uses}} recorded so far"""
+        with self._lock:
+            return dict((k, dict(v)) for k, v in self._usage.items())
+
+    def clear(self):
+        with self._lock:
+            self._columns.clear()
+            self._usage.clear()
+
+    def report(self, bind=None, dialect=None):
+        """ranked list of missing indexes
+
+        :param bind: engine or connection; when given the indexes are read from the
+            database catalog with an inspector instead of the ``MetaData``
+        :param dialect: dialect the DDL is written for, default the bind's or a generic one
+        :rtype: list of :class:`Recommendation`
+        """
+        if dialect is None:
+            dialect = bind.dialect if bind is not None else default.DefaultDialect()
+        inspector = sa.inspect(bind) if bind is not None else None
+        with self._lock:
+            usage = [(key, self._columns[key], dict(actions)) for key, actions in self._usage.items()]
+
+        existing = {}
+        wanted = {}
+        for key, column, actions in usage:
+            table = column.table
+            if table.fullname not in existing:
+                if inspector is not None:
+                    existing[table.fullname] = _inspector_indexes(inspector, table)
+                else:
+                    existing[table.fullname] = _metadata_indexes(table)
+            for action, uses in actions.items():
+                kind = _index_kind(column, action, dialect)
+                if kind is None or (column.name, kind) in existing[table.fullname]:
+                    continue
+                entry = wanted.setdefault((key, kind), [column, {}])
+                entry[1][action] = uses
+
+        recommendations = []
+        for ((table, name), kind), (column, actions) in wanted.items():
+            ddl, reason = _ddl(column, kind, dialect, actions)
+            recommendations.append(Recommendation(
+                table, name, kind, sorted(actions), sum(actions.values()), ddl, reason))
+        recommendations.sort(key=lambda r: (-r.uses, r.table, r.column, r.kind))
+        return recommendations
+
+
+def _ddl(column, kind, dialect, actions):
+    """CREATE INDEX statement and reason for one recommendation"""
+    quote = dialect.identifier_preparer.quote
+    table = dialect.identifier_preparer.format_table(column.table)
+    name = quote('ix_{0}_{1}{2}'.format(column.table.name, 'lower_' if kind == 'lower' else '', column.name))
+    col = quote(column.name)
+    if kind == 'trigram':
+        return ('CREATE INDEX {0} ON {1} USING gin ({2} gin_trgm_ops)'.format(name, table, col),
+                'substring search needs a trigram index (pg_trgm)')
+    if kind == 'lower':
+        return ('CREATE INDEX {0} ON {1} (lower({2}))'.format(name, table, col),
+                'ilike compiles to lower(); a leading % limits this to an index scan, '
+                'a trigram or full text index is needed for a search')
+    return ('CREATE INDEX {0} ON {1} ({2})'.format(name, table, col),
+            'relate() joins on this column' if 'join' in actions else 'no index starts with this column')
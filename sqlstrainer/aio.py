@@ -0,0 +1,107 @@
+"""Runs strained select() statements on an AsyncSession
+
+Requires Python 3.6+ and SQLAlchemy 1.4+ with an async driver (asyncpg,
+aiosqlite, ...).  Nothing here blocks the event loop or needs a thread offload.
+
+.. code::
+
+    strained, errors = customer_strainer.build(request_data)
+    async with AsyncSession(engine) as session:
+        customers = await fetch(session, strained, limit=50)
+        total = await count(session, strained)
+        async for customer in stream(session, strained):
+            ...
+
+Each helper takes an optional ``select()`` to strain, by default the base
+entity of the strainer is selected.
+
+.. autofunction:: statement
+
+.. autofunction:: fetch
+
+.. autofunction:: count
+
+.. autofunction:: stream
+
+.. autofunction:: page
+"""
+import asyncio
+from collections import OrderedDict
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from sqlstrainer.strainer import Page
+
+__author__ = 'Douglas MacDougall <douglas.macdougall@moesol.com>'
+
+
+def statement(strained, select=None):
+    """strained ``select()``, of the base entity when `select` is not given"""
+    if select is None:
+        select = sa.select(strained.strainer.base.entity)
+    return strained.strain(select)
+
+
+async def fetch(session, strained, select=None, limit=None, offset=None, scalars=True):
+    """runs the strained statement and returns all rows
+
+    :param session: AsyncSession
+    :param strained: StrainerFilter from :meth:`Strainer.build`
+    :param select: statement to strain
+    :param scalars: return the first column (the entity) of each row
+    :return: list of entities or rows
+    """
+    stmt = statement(strained, select)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    if offset is not None:
+        stmt = stmt.offset(offset)
+    result = await session.execute(stmt)
+    return result.scalars().all() if scalars else result.all()
+
+
+async def count(session, strained, select=None):
+    """number of rows the strained statement returns"""
+    stmt = statement(strained, select).order_by(None)
+    return await session.scalar(sa.select(sa.func.count()).select_from(stmt.subquery()))
+
+
+async def stream(session, strained, select=None, batch_size=1000, scalars=True):
+    """yields rows while they are fetched with a server side cursor
+
+    :param batch_size: rows buffered at a time
+    """
+    stmt = statement(strained, select).execution_options(yield_per=batch_size)
+    result = await session.stream(stmt)
+    if scalars:
+        result = result.scalars()
+    async for row in result:
+        yield row
+
+
+async def _in_session(bind, run, *args, **kwargs):
+    async with AsyncSession(bind) as session:
+        return await run(session, *args, **kwargs)
+
+
+async def _facet(session, strained, select, key):
+    result = await session.execute(strained.facet(select if select is not None else sa.select(), key))
+    return result.all()
+
+
+async def page(bind, strained, limit, offset=0, select=None, facets=None):
+    """runs the page, count and facet queries at the same time with ``asyncio.gather``
+
+    Each query gets its own AsyncSession and pooled connection from `bind`.
+
+    :param bind: AsyncEngine
+    :param facets: ``relative.column`` names to count values of
+    :rtype: sqlstrainer.strainer.Page
+    """
+    facets = list(facets or ())
+    results = await asyncio.gather(
+        _in_session(bind, fetch, strained, select, limit=limit, offset=offset),
+        _in_session(bind, count, strained, select),
+        *[_in_session(bind, _facet, strained, select, key) for key in facets])
+    return Page(results[0], results[1], OrderedDict(zip(facets, results[2:])))
@@ -0,0 +1,122 @@
+"""Scores filter requests and keeps them within a budget
+
+A request is scored from its raw filter data, before any value is deserialized
+or criteria is built, so outliers are turned away at the cheapest point.
+
+.. code::
+
+    strainer = Strainer(Customer, cost=CostModel(budget=50))
+    strained, errors = strainer.build(request_data)
+    # errors['_cost'] == ['filter cost 73.4 exceeds budget 50']
+
+A rejected request builds a :class:`~sqlstrainer.strainer.StrainerFilter`
+that matches no rows, so a caller that ignores the errors never runs the query
+unfiltered.  With ``degrade=True`` the entries that fit the budget are kept (in
+request order) and the rest are dropped and reported, instead of rejecting the
+request.
+
+Scoring, every weight is configurable:
+
+* filter: each entry
+* value: each value of an entry
+* unindexable: each entry with an action a B-tree index cannot serve (``contains``)
+* join: each relationship hop of a relative, once per request
+* to_many: each one-to-many or many-to-many hop of a relative, once per request
+
+.. autoclass:: CostModel
+    :members:
+"""
+from sqlstrainer._compat import string_types
+
+__author__ = 'Douglas MacDougall <douglas.macdougall@moesol.com>'
+
+_OVER_BUDGET = 'filter cost {0:g} exceeds budget {1:g}'
+_DROPPED = 'dropped over budget: {0}'
+
+
+class CostModel(object):
+    """Weights and budget for the cost of a filter request
+
+    :param budget: highest allowed score
+    :param degrade: drop the entries over budget instead of rejecting the request
+    """
+
+    unindexable_actions = ('contains', 'notcontains')
+
+    def __init__(self, budget=100, degrade=False, filter=1.0, value=0.2, unindexable=3.0, join=2.0, to_many=4.0):
+        self.budget = budget
+        self.degrade = degrade
+        self.filter = filter
+        self.value = value
+        self.unindexable = unindexable
+        self.join = join
+        self.to_many = to_many
+
+    def relative_cost(self, relative):
+        """cost of joining a relative"""
+        cost = 0
+        for hop in relative.join:
+            cost += self.join
+            if getattr(getattr(hop, 'property', None), 'uselist', False):
+                cost += self.to_many
+        return cost
+
+    def entry_cost(self, strainer, entry):
+        """(cost, relative name or None) of a single filter entry, the join is not included"""
+        if not isinstance(entry, dict):
+            return self.filter, None
+        cost = self.filter
+        values = entry.get('values')
+        if values is not None:
+            cost += self.value * (len(values) if isinstance(values, (list, tuple)) else 1)
+        if entry.get('action', 'contains') in self.unindexable_actions:
+            cost += self.unindexable
+        relative = None
+        name = entry.get('name')
+        if isinstance(name, string_types) and name.count('.') == 1:
+            tbl = name.split('.')[0]
+            if tbl != strainer.tablename and tbl in strainer.relatives:
+                relative = tbl
+        return cost, relative
+
+    def _costs(self, strainer, data):
+        """yields (entry, cost including the join of the first use of a relative)"""
+        joined = set()
+        for entry in data:
+            cost, relative = self.entry_cost(strainer, entry)
+            if relative is not None and relative not in joined:
+                joined.add(relative)
+                cost += self.relative_cost(strainer.relatives[relative])
+            yield entry, cost
+
+    def score(self, strainer, data):
+        """total cost of a list of filter entries"""
+        return sum(cost for _, cost in self._costs(strainer, data))
+
+    def apply(self, strainer, data):
+        """keeps a request within budget
+
+        :return: (entries to load or None when the request is rejected, errors);
+            errors hold ``_cost`` when over budget
+        """
+        data = list(data)
+        total = self.score(strainer, data)
+        if total <= self.budget:
+            return data, {}
+        errors = {'_cost': [_OVER_BUDGET.format(total, self.budget)]}
+        if not self.degrade:
+            return None, errors
+        kept = []
+        spent = 0
+        joined = set()
+        for entry in data:
+            cost, relative = self.entry_cost(strainer, entry)
+            if relative is not None and relative not in joined:
+                cost += self.relative_cost(strainer.relatives[relative])
+            if spent + cost <= self.budget:
+                spent += cost
+                kept.append(entry)
+                joined.add(relative)
+            else:
+                errors['_cost'].append(_DROPPED.format(entry))
+        return kept, errors
@@ -0,0 +1,184 @@
+"""Slow filter log: SQL, parameter shape and EXPLAIN of slow strained queries
+
+Opt in per strainer (or per StrainerFilter) and instrument the engine.  Every
+strained query that takes longer than `threshold` seconds to execute is
+recorded under its base mapper and the fingerprint of its filter shape, so one
+slow combination of filters shows up as one entry no matter which values were
+searched for.  Values are never recorded, only the type of each bound parameter.
+
+Only ``cursor.execute`` is timed, fetching the rows is not.  Databases that
+compute the whole result before returning (PostgreSQL with its default client
+side cursor, MySQL) are measured in full, but SQLite and streamed (server side)
+results do most of their work while rows are fetched, so set a lower
+`threshold` for them.
+
+.. code::
+
+    slow = SlowFilterLog(threshold=0.5)
+    slow.attach(engine)
+    customer_strainer.diagnostics = slow
+
+    strained, errors = customer_strainer.build(request_data)
+    strained.strain(session.query(Customer)).all()
+
+    json.dump(slow.export(), out)
+
+EXPLAIN is run on the connection of the slow query the first time a
+fingerprint is recorded and whenever it gets slower than before, as
+``EXPLAIN QUERY PLAN`` on SQLite and ``EXPLAIN`` on PostgreSQL and MySQL.
+Other dialects are logged without a plan.
+
+The log keeps the `maxsize` most recently slow filter shapes.
+
+.. autoclass:: SlowFilterLog
+    :members:
+
+.. autoclass:: SlowFilter
+    :members:
+"""
+import threading
+from collections import OrderedDict
+from time import time
+
+from sqlstrainer import instrument
+
+__author__ = 'Douglas MacDougall <douglas.macdougall@moesol.com>'
+
+"""EXPLAIN prefix by dialect name"""
+explain_prefixes = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+    'mysql': 'EXPLAIN ',
+}
+
+
+def _param_shape(parameters, executemany=False):
+    """type names of the bound parameters, by position or name"""
+    if executemany:
+        parameters = parameters[0] if parameters else ()
+    if isinstance(parameters, dict):
+        return OrderedDict((k, type(parameters[k]).__name__) for k in sorted(parameters))
+    return [type(p).__name__ for p in parameters or ()]
+
+
+def _explain(conn, statement, parameters):
+    """rows of the dialect's EXPLAIN of `statement`, None when the dialect has none"""
+    prefix = explain_prefixes.get(conn.dialect.name)
+    if prefix is None:
+        return None
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return [list(row) for row in cursor.fetchall()]
+    except Exception as e:
+        return ['EXPLAIN failed: {0}'.format(e)]
+    finally:
+        cursor.close()
+
+
+class SlowFilter(object):
+    """Slow executions of one filter shape"""
+    __slots__ = ('fingerprint', 'mapper', 'count', 'total', 'worst', 'last', 'sql', 'params', 'plan')
+
+    def __init__(self, fingerprint, mapper):
+        self.fingerprint = fingerprint
+        self.mapper = mapper
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.last = None
+        self.sql = None
+        self.params = None
+        self.plan = None
+
+    def as_dict(self):
+        """JSON serializable summary, the SQL and plan are those of the slowest run"""
+        return OrderedDict([
+            ('fingerprint', self.fingerprint),
+            ('mapper', getattr(getattr(self.mapper, 'class_', None), '__name__', str(self.mapper))),
+            ('count', self.count),
+            ('total', self.total),
+            ('mean', self.total / self.count if self.count else 0.0),
+            ('worst', self.worst),
+            ('last', self.last),
+            ('sql', self.sql),
+            ('params', self.params),
+            ('plan', self.plan),
+        ])
+
+    def __repr__(self):
+        return '<SlowFilter {0} {1} x{2} worst {3:.6f}s>'.format(
+            self.mapper, self.fingerprint, self.count, self.worst)
+
+
+class SlowFilterLog(object):
+    """Bounded in-process log of slow strained queries, keyed by base mapper and
+    filter fingerprint
+
+    :param threshold: seconds spent in ``cursor.execute`` above which a query
+        is recorded, fetching rows is not included
+    :param maxsize: filter shapes kept, the least recently slow is dropped first
+    :param explain: run EXPLAIN on slow queries
+    """
+
+    def __init__(self, threshold=0.5, maxsize=100, explain=True):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.explain = explain
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def attach(self, engine):
+        """instruments `engine` so strained queries run on it are timed"""
+        return instrument.instrument_engine(engine)
+
+    def tag(self, query, mapper, fingerprint):
+        """marks a strained query to be timed into this log"""
+        return instrument.tag_diagnostics(query, self, mapper, fingerprint)
+
+    def observe(self, conn, statement, parameters, elapsed, mapper, fingerprint, executemany=False):
+        """records an execution that took `elapsed` seconds if it was slow"""
+        if elapsed <= self.threshold:
+            return
+        key = (mapper, fingerprint)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                entry = SlowFilter(fingerprint, mapper)
+            self._entries[key] = entry
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            slower = elapsed > entry.worst
+            entry.count += 1
+            entry.total += elapsed
+            entry.last = time()
+            if slower:
+                entry.worst = elapsed
+                entry.sql = statement
+                entry.params = _param_shape(parameters, executemany)
+        if slower and self.explain and not executemany:
+            plan = _explain(conn, statement, parameters)
+            with self._lock:
+                if entry.worst == elapsed:
+                    entry.plan = plan
+
+    def get(self, mapper, fingerprint):
+        """SlowFilter of a base mapper and fingerprint or None"""
+        return self._entries.get((mapper, fingerprint))
+
+    def entries(self):
+        """recorded SlowFilters, largest total time first"""
+        with self._lock:
+            entries = list(self._entries.values())
+        return sorted(entries, key=lambda e: -e.total)
+
+    def export(self):
+        """list of :meth:`SlowFilter.as_dict`, largest total time first"""
+        return [e.as_dict() for e in self.entries()]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
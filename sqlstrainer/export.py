@@ -0,0 +1,206 @@
+"""Streams filtered views into CSV, JSON Lines or Arrow IPC
+
+Rows come from a :class:`sqlstrainer.view.StrainerView` (no ORM entities are
+loaded), are fetched with ``Query.yield_per`` and handed to a writer in batches,
+so memory use is bound by ``batch_size`` instead of the size of the result.
+
+.. code::
+
+    strained, errors = customer_strainer.build(request_data)
+    with open('customers.csv', 'w') as out:
+        export(session, strained, ['first_name', 'parent.first_name'], CSVWriter(out))
+
+View keys use the same ``relative.column`` names as filters and the headers are
+the viewable labels of the columns.  Rows are not deduplicated: every matching
+base row is exported, and filters on to-many relatives are applied as a
+semi-join on the base key, so the query streams without a DISTINCT sort.
+
+.. autofunction:: export
+
+.. autoclass:: CSVWriter
+    :members:
+
+.. autoclass:: JSONLinesWriter
+    :members:
+
+.. autoclass:: ArrowWriter
+    :members:
+"""
+import csv
+import json
+import datetime
+from decimal import Decimal
+from inspect import getmro
+from itertools import islice
+
+import sqlalchemy as sa
+
+from sqlstrainer.view import StrainerView
+
+__author__ = 'Douglas MacDougall <douglas.macdougall@moesol.com>'
+
+
+def export_query(session, strained, keys):
+    """builds the column query for a filtered view
+
+    :param session: SQLAlchemy session
+    :param strained: StrainerFilter from :meth:`Strainer.build`
+    :param keys: list of view keys
+    :return: (labels, column types, query)
+    """
+    view = StrainerView(strained.strainer, keys)
+    return view.labels, view.types, view.query(session, strained)
+
+
+def iter_batches(query, batch_size=1000):
+    """yields lists of at most `batch_size` rows while streaming the result"""
+    rows = iter(query.yield_per(batch_size))
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def export(session, strained, keys, writer, batch_size=1000):
+    """streams a filtered view into a writer
+
+    :param session: SQLAlchemy session
+    :param strained: StrainerFilter from :meth:`Strainer.build`
+    :param keys: list of view keys such as ``['first_name', 'parent.first_name']``
+    :param writer: CSVWriter, JSONLinesWriter, ArrowWriter or similar
+    :param batch_size: rows fetched and written at a time
+    :return: number of rows written
+    """
+    labels, types, query = export_query(session, strained, keys)
+    writer.write_header(labels, types)
+    count = 0
+    for batch in iter_batches(query, batch_size):
+        writer.write_batch(batch)
+        count += len(batch)
+    writer.close()
+    return count
+
+
+class CSVWriter(object):
+    """Writes rows with :func:`csv.writer`, labels as the header row"""
+
+    def __init__(self, stream, **fmtparams):
+        self._writer = csv.writer(stream, **fmtparams)
+        self._stream = stream
+
+    def write_header(self, labels, types):
+        self._writer.writerow(labels)
+
+    def write_batch(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._stream.flush()
+
+
+def _json_default(o):
+    if isinstance(o, (datetime.date, datetime.time)):
+        return o.isoformat()
+    if isinstance(o, Decimal):
+        return float(o)
+    if isinstance(o, datetime.timedelta):
+        return o.total_seconds()
+    raise TypeError(repr(o))
+
+
+class JSONLinesWriter(object):
+    """Writes one JSON object per row keyed by label"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._labels = None
+        self._encode = json.JSONEncoder(default=_json_default).encode
+
+    def write_header(self, labels, types):
+        self._labels = labels
+
+    def write_batch(self, rows):
+        labels, encode = self._labels, self._encode
+        self._stream.write(''.join(encode(dict(zip(labels, row))) + '\n' for row in rows))
+
+    def close(self):
+        self._stream.flush()
+
+
+def _arrow_types(pa):
+    return {
+        sa.Boolean: pa.bool_(),
+        sa.Integer: pa.int64(),
+        sa.Numeric: pa.float64(),
+        sa.String: pa.string(),
+        sa.Date: pa.date32(),
+        sa.DateTime: pa.timestamp('us'),
+        sa.Time: pa.time64('us'),
+        sa.Interval: pa.duration('us'),
+    }
+
+
+def _to_float(v):
+    return v if v is None else float(v)
+
+
+def _to_str(v):
+    return v if v is None else str(v)
+
+
+class ArrowWriter(object):
+    """Writes an Arrow IPC stream, one record batch per fetched batch
+
+    Requires `pyarrow`.  Column types come from the SQL column types, anything
+    unknown is written as a string.
+    """
+
+    def __init__(self, sink):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError('ArrowWriter requires pyarrow')
+        self._pa = pa
+        self._sink = sink
+        self._writer = None
+        self._schema = None
+        self._converters = None
+
+    def write_header(self, labels, types):
+        pa = self._pa
+        known = _arrow_types(pa)
+        fields = []
+        self._converters = []
+        for label, col_type in zip(labels, types):
+            arrow_type, convert = pa.string(), _to_str
+            for t in getmro(type(col_type)):
+                if t in known:
+                    arrow_type, convert = known[t], None
+                    if t is sa.Numeric:
+                        convert = _to_float
+                    break
+            fields.append(pa.field(label, arrow_type))
+            self._converters.append(convert)
+        self._schema = pa.schema(fields)
+        self._writer = pa.ipc.new_stream(self._sink, self._schema)
+
+    def write_batch(self, rows):
+        pa = self._pa
+        arrays = []
+        for i, (field, convert) in enumerate(zip(self._schema, self._converters)):
+            values = [row[i] for row in rows]
+            if convert is not None:
+                values = [convert(v) for v in values]
+            arrays.append(pa.array(values, type=field.type))
+        self._writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+writers = {
+    'csv': CSVWriter,
+    'jsonl': JSONLinesWriter,
+    'arrow': ArrowWriter,
+}
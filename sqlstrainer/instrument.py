@@ -0,0 +1,147 @@
+"""Phase timings and counters for building and running strained queries
+
+Listeners are called with a :class:`PhaseEvent` for every phase.  Nothing is
+timed or counted unless at least one listener is attached.
+
+.. code::
+
+    from sqlstrainer import instrument
+
+    def log_phase(event):
+        log.info('%s %s %s %.2fms %r', event.phase, event.mapper, event.fingerprint,
+                 event.elapsed * 1000, event.counters)
+
+    instrument.listen(log_phase)
+    instrument.instrument_engine(engine)  # sql and execute phases
+
+Phases:
+
+* build: :meth:`Strainer.build` from data to StrainerFilter
+  (filters, errors, values, max_values)
+* validate: checking and deserializing filter entries (entries)
+* compile: building criteria with the :mod:`sqlstrainer.match` matchers (filters)
+* strain: :meth:`StrainerFilter.strain` query assembly (filters, joins, distinct)
+* sql: SQL compilation of a strained query (sql_length)
+* execute: ``cursor.execute`` of a strained query, not fetching its rows (sql_length)
+
+``sql`` and ``execute`` need :func:`instrument_engine` and a strained ``Query``.
+The same engine hooks time queries for :mod:`sqlstrainer.diagnostics`.
+
+.. autofunction:: listen
+
+.. autofunction:: remove
+
+.. autofunction:: instrument_engine
+
+.. autoclass:: PhaseEvent
+"""
+import hashlib
+from time import time
+
+from sqlalchemy import event
+
+__author__ = 'Douglas MacDougall <douglas.macdougall@moesol.com>'
+
+"""attached listeners, checked before any timing is done"""
+listeners = []
+
+_TAG = 'sqlstrainer'
+_DIAGNOSE = 'sqlstrainer.diagnose'
+_START = 'sqlstrainer.start'
+
+
+class PhaseEvent(object):
+    """Timing of one phase, tagged by base mapper and filter fingerprint"""
+    __slots__ = ('phase', 'elapsed', 'mapper', 'fingerprint', 'counters')
+
+    def __init__(self, phase, elapsed, mapper, fingerprint, counters):
+        self.phase = phase
+        self.elapsed = elapsed
+        self.mapper = mapper
+        self.fingerprint = fingerprint
+        self.counters = counters
+
+    def __repr__(self):
+        return '<PhaseEvent {0} {1} {2} {3:.6f}s {4!r}>'.format(
+            self.phase, self.mapper, self.fingerprint, self.elapsed, self.counters)
+
+
+def listen(listener):
+    """attaches a callable that receives every :class:`PhaseEvent`"""
+    if listener not in listeners:
+        listeners.append(listener)
+    return listener
+
+
+def remove(listener):
+    """detaches a listener"""
+    listeners.remove(listener)
+
+
+def emit(phase, elapsed, mapper, fingerprint, **counters):
+    """sends a PhaseEvent to every listener"""
+    e = PhaseEvent(phase, elapsed, mapper, fingerprint, counters)
+    for listener in list(listeners):
+        listener(e)
+
+
+def fingerprint(filters):
+    """canonical hash of the shape of a filter list
+
+    Names, actions, find, not and the number of values count, the values do not.
+    """
+    shape = sorted((f['name'], f.get('action', 'contains'), f.get('find', 'any'),
+                    bool(f.get('not')), len(f.get('values') or ())) for f in filters or ())
+    return hashlib.sha1(repr(shape).encode('utf-8')).hexdigest()[:16]
+
+
+def tag_query(query, mapper, fingerprint):
+    """marks a query so :func:`instrument_engine` can report it"""
+    return query.execution_options(**{_TAG: (mapper, fingerprint)})
+
+
+def tag_diagnostics(query, log, mapper, fingerprint):
+    """marks a query so :func:`instrument_engine` times it into a
+    :class:`sqlstrainer.diagnostics.SlowFilterLog`"""
+    return query.execution_options(**{_DIAGNOSE: (log, mapper, fingerprint)})
+
+
+def _before_execute(conn, clauseelement, *args):
+    # SQLAlchemy 1.4+ passes execution_options as well
+    conn.info[_START] = time()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    options = context.execution_options
+    tag = options.get(_TAG) if listeners else None
+    if tag is None and _DIAGNOSE not in options:
+        return
+    now = time()
+    start = conn.info.pop(_START, None)
+    if tag is not None and start is not None:
+        emit('sql', now - start, tag[0], tag[1], sql_length=len(statement))
+    context._sqlstrainer_start = now
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_sqlstrainer_start', None)
+    if start is None:
+        return
+    elapsed = time() - start
+    options = context.execution_options
+    tag = options.get(_TAG)
+    if tag is not None and listeners:
+        emit('execute', elapsed, tag[0], tag[1], sql_length=len(statement))
+    diagnose = options.get(_DIAGNOSE)
+    if diagnose is not None:
+        log, mapper, fingerprint = diagnose
+        log.observe(conn, statement, parameters, elapsed, mapper, fingerprint, executemany)
+
+
+def instrument_engine(engine):
+    """reports the sql and execute phases of strained queries run on `engine`"""
+    if not event.contains(engine, 'before_execute', _before_execute):
+        event.listen(engine, 'before_execute', _before_execute)
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    return engine
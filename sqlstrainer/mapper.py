@@ -6,9 +6,16 @@
 .. autoclass:: ColumnEntry
     :members:
 """
-from six import iteritems, string_types
-from sqlalchemy import inspect
-from sqlalchemy.orm import _mapper_registry
+import threading
+from collections import OrderedDict
+from time import time
+from sqlstrainer._compat import iteritems, string_types
+from sqlalchemy import exc as sa_exc, inspect
+try:
+    from sqlalchemy.orm import _mapper_registry
+except ImportError:
+    # SQLAlchemy 1.4+ keeps the mappers in registries
+    _mapper_registry = None
 from sqlalchemy.orm.attributes import InstrumentedAttribute
 from sqlalchemy.orm.properties import ColumnProperty
 from sqlalchemy.ext.hybrid import hybrid_property
@@ -17,59 +24,150 @@ class NoPathAvailable(Exception):
     """Relationship path does not exist"""
 
 
+_UNRESOLVED = object()
+_DYNAMIC = object()
+
+
+def _all_mappers():
+    """{mapper: is_primary} of every mapper"""
+    if _mapper_registry is not None:
+        return _mapper_registry
+    from sqlalchemy.orm.mapper import _all_registries
+    return dict((m, not m.non_primary) for r in _all_registries() for m in r.mappers)
+
+
 class _StrainerColumn(object):
-    """Simple class to hold mapper and column data"""
-    # COLUMN = 'column'
-    # HYBRID = 'hybrid'
-    # PROPERTY = 'property'
-    # ext = COLUMN
+    """Simple class to hold mapper and column data
+
+    The SQL expression is resolved once, hybrid expressions on first use.  Hybrids
+    whose expression depends on runtime state opt out with
+    ``@strainer_property(cache_expression=False)`` and are rebuilt on every access.
+    """
+    __slots__ = ('mapper', 'name', 'label', 'viewable', 'filterable', '_column', '_expression')
 
-    def __init__(self, mapper, name, column, label=None, viewable=True, filterable=True, **other_info):
+    def __init__(self, mapper, name, column, label=None, viewable=True, filterable=True,
+                 cache_expression=True, **other_info):
         self.mapper = mapper
         self.name = name
         self._column = column
         self.label = label if label is not None else name.replace('_', ' ').title()
         self.viewable = viewable
-        if not (isinstance(column, InstrumentedAttribute) or isinstance(column, hybrid_property)):
+        if isinstance(column, InstrumentedAttribute):
+            self._expression = column
+        elif isinstance(column, hybrid_property):
+            self._expression = _UNRESOLVED if cache_expression else _DYNAMIC
+        else:
             # cannot filter on instance properties
+            self._expression = None
             filterable = False
         self.filterable = filterable
 
+    @property
+    def dynamic(self):
+        """True when the expression is rebuilt on every access"""
+        return self._expression is _DYNAMIC
+
     @property
     def column(self):
-        if isinstance(self._column, InstrumentedAttribute):
-            return self._column
-        if isinstance(self._column, hybrid_property):
+        expression = self._expression
+        if expression is _UNRESOLVED:
+            expression = self._expression = getattr(self.mapper.entity, self.name)
+        elif expression is _DYNAMIC:
             return getattr(self.mapper.entity, self.name)
-        # should not be called on property
+        return expression
 
     def __repr__(self):
         return '<StrainerColumn {0}.{1}>'.format(self.mapper.entity.__tablename__, self.name)
 
 
+class _LRUCache(object):
+    """Small thread safe least recently used cache, entries expire after `ttl` seconds if given"""
+
+    _clock = staticmethod(time)
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            if self.ttl is not None:
+                expires, value = value
+                if expires < self._clock():
+                    return default
+                value = (expires, value)
+            self._data[key] = value
+            return value if self.ttl is None else value[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value if self.ttl is None else (self._clock() + self.ttl, value)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def __len__(self):
+        return len(self._data)
+
+
 class StrainerMap():
     """Database Map
 
     Helper class that holds SQLAlchemy ORM relationship and column information in lookup tables.
 
     Instantiate with a dictionary of {mapper: is_primary}.
-    By default, uses :data:`sqlalchemy.orm._mapper_registry`.
+    By default, uses :data:`sqlalchemy.orm._mapper_registry`, :meth:`for_base`
+    limits the map to one declarative base.
+
+    Resolved join paths are kept in a bounded LRU cache of `cache_size` entries,
+    :meth:`refresh` rebuilds the map and drops them.
+
+    A path element naming a subclass (polymorphic identity, tablename or model)
+    narrows the relationship before it with ``of_type``, only that subclass's
+    table is joined.
     """
 
-    def __init__(self, registry=None):
-        if registry is None:
-            registry = _mapper_registry
-        self._columns = {}
-        self._relations = {}
+    def __init__(self, registry=None, base=None, cache_size=1024):
+        self._registry = registry
+        self._base = base
+        self._cache_size = cache_size
+        self.refresh()
+
+    def refresh(self):
+        """rebuilds the lookup tables (e.g. after more models were mapped) and clears cached paths"""
+        registry = self._registry if self._registry is not None else _all_mappers()
+        columns = {}
+        relations = {}
+        subtypes = {}
         # filters non-primary entries
-        for mapper, _ in filter(lambda x: x[1], iteritems(registry)):
+        for mapper, _ in filter(lambda x: x[1], list(iteritems(registry))):
+            if self._base is not None and not issubclass(mapper.class_, self._base):
+                continue
+            rels = relations.setdefault(mapper, {})
+            if mapper.polymorphic_map:
+                # subclasses by identity and tablename, looked up without walking the hierarchy
+                index = subtypes[mapper] = {}
+                for child in mapper.self_and_descendants:
+                    index[child] = child
+                    # single table subclasses share (and inherit) the table name
+                    if child.inherits is None or child.local_table is not child.inherits.local_table:
+                        index[child.local_table.name] = child
+                for identity, child in iteritems(mapper.polymorphic_map):
+                    if child.isa(mapper):
+                        index[identity] = child
             for rprop in mapper.relationships:
-                rels = self._relations.setdefault(mapper, {})
                 rels[rprop.class_attribute] = rprop.mapper# .self_and_descendants
 
             cls = mapper.class_
             tbl = cls.__tablename__
-            model = self._columns[tbl] = {}
+            model = columns[tbl] = {}
             exclude = set()
             for supercls in mapper.class_.__mro__:
                 for key in set(supercls.__dict__).difference(exclude):
@@ -83,6 +181,19 @@ class StrainerMap():
                     else:
                         continue
                     model[key] = _StrainerColumn(mapper, key, o, **info)
+        self._columns = columns
+        self._relations = relations
+        self._subtypes = subtypes
+        self._paths = _LRUCache(self._cache_size)
+
+    @classmethod
+    def for_base(cls, base, **kwargs):
+        """map of only the models of one declarative base
+
+        :param base: declarative base class
+        :rtype: StrainerMap
+        """
+        return cls(base=base, **kwargs)
 
     def __contains__(self, item):
         self.get(item) is not None
@@ -139,6 +250,9 @@ class StrainerMap():
         """takes a mapper, model or relationship and returns the target mapper"""
         obj = inspect(obj)
         if obj.is_attribute:
+            of_type = getattr(obj, '_of_type', None)
+            if of_type is not None:
+                return inspect(of_type).mapper
             obj = getattr(obj.property, 'mapper', obj)
         if not obj.is_mapper:
             raise TypeError('object must be a mapper, model or relationship')
@@ -223,35 +337,71 @@ class StrainerMap():
             if find == child:
                 return child
 
+    def subtype(self, base, find):
+        """finds a subclass of `base` in the precomputed polymorphic index
+
+        :param base: a base mapper
+        :param find: polymorphic identity, tablename, mapper or model of the subclass
+        :return: mapper of the subclass or None
+        """
+        index = self._subtypes.get(base)
+        if not index:
+            return None
+        if not isinstance(find, string_types):
+            try:
+                find = self.to_mapper(find)
+            except (TypeError, sa_exc.NoInspectionAvailable):
+                return None
+        return index.get(find)
+
+    @staticmethod
+    def _polymorphic_hop(relations, base, child):
+        """narrows the last relationship of `relations` to `child` with ``of_type``,
+        so only the subclass's table is joined"""
+        if child is base:
+            return
+        if relations and getattr(relations[-1], 'property', None) is not None:
+            relations[-1] = relations[-1].of_type(child.class_)
+        else:
+            # no relationship to narrow, the subclass is joined by itself
+            relations.append(child)
+
     def join_path(self, path):
         """Converts a list of models into a list of relationships which can be used in a join
 
+        Results are cached, `path` is not modified.
+
         :param path: list of models, mappers or relationships
         :return: list of relationships
         :rtype: list
         :raises: NoPathAvailable: an element in the path missing
         """
-
+        key = ('path',) + tuple(o if isinstance(o, string_types) else inspect(o) for o in path)
+        paths = self._paths
+        relations = paths.get(key)
+        if relations is None:
+            relations = paths.put(key, tuple(self._join_path(path)))
+        return list(relations)
+
+    def _join_path(self, path):
         relations = []
-        root = self.to_mapper(path.pop(0))
-        if not path:
-            raise NoPathAvailable
-        children = self._relations.get(root)
-        if not children:
+        root = self.to_mapper(path[0])
+        if len(path) < 2:
             raise NoPathAvailable
-        for o in path:
+        for o in path[1:]:
+            children = self._relations.get(root)
+            if not children:
+                raise NoPathAvailable
             r = self.first_relation(children, o)
             if r:
                 relations.append(r)
                 root = children.get(r)
             else:
-                root = self.polymorphic_relation(root, o)
-                if not root:
+                child = self.subtype(root, o)
+                if not child:
                     raise NoPathAvailable
-                relations.append(root) # mapper, not relationship.. will work in join?
-            children = self._relations.get(root)
-            if not children:
-                raise NoPathAvailable
+                self._polymorphic_hop(relations, root, child)
+                root = child
         return relations
 
     def relations_of(self, mapper):
@@ -264,22 +414,37 @@ class StrainerMap():
         return self._relations[mapper]
 
     def join_from_dotted(self, dottedPath):
-        path = dottedPath.split('.')
+        """Converts ``table.relationship.relationship`` into a list of relationships
+
+        Results are cached by the normalized path.
+
+        :raises: NoPathAvailable: an element in the path missing
+        """
+        path = [p.strip() for p in dottedPath.split('.')]
         if len(path) < 2:
             raise AttributeError(dottedPath)
-
-        mapper = self.get_mapper(path.pop(0))
+        key = ('dotted', '.'.join(path))
+        paths = self._paths
+        join = paths.get(key)
+        if join is None:
+            join = paths.put(key, tuple(self._join_from_dotted(path, dottedPath)))
+        return list(join)
+
+    def _join_from_dotted(self, path, dottedPath):
+        mapper = self.get_mapper(path[0])
+        if mapper is None:
+            raise NoPathAvailable(dottedPath)
         join = []
 
-        for name in path:
+        for name in path[1:]:
             relations = list(filter(lambda r: r.key == name, self._relations[mapper]))
             if len(relations) == 1:
                 join.append(relations[0])
                 mapper = self.to_mapper(relations[0])
             else:
-                child = self.polymorphic_relation(mapper, name)
+                child = self.subtype(mapper, name)
                 if not child:
                     raise NoPathAvailable(dottedPath)
-                join.append(child)
+                self._polymorphic_hop(join, mapper, child)
                 mapper = child
         return join
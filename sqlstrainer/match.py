@@ -27,7 +27,6 @@ from functools import wraps
 # c = Column:
 # d = Data
 # """
-from marshmallow import fields
 
 _default = {
     'contains': lambda c, d: sa.cast(c, sa.String).like('%{0}%'.format(str(d))),
@@ -101,40 +100,48 @@ matchers = {
 
 }
 
-_bool_d = fields.Boolean().deserialize
-_string_d = fields.String().deserialize
-_numeric_d = fields.Float().deserialize
-_int_d = fields.Integer().deserialize
-_date_d = fields.Date().deserialize
-_datetime_d = fields.DateTime().deserialize
-_time_d = fields.Time().deserialize
+"""column type: deserializer, filled in with the marshmallow fields on first use"""
+deserializers = {}
 
-deserializers = {
-    sa.Boolean: _bool_d,
-    ClauseElement: _bool_d,
-    NullType: _bool_d,
 
-    sa.String: _string_d,
+def _load_deserializers():
+    from marshmallow import fields
+    _bool_d = fields.Boolean().deserialize
+    _string_d = fields.String().deserialize
+    _numeric_d = fields.Float().deserialize
+    _int_d = fields.Integer().deserialize
+    defaults = {
+        sa.Boolean: _bool_d,
+        ClauseElement: _bool_d,
+        NullType: _bool_d,
 
-    sa.Numeric: _numeric_d,
-    sa.Integer: _int_d,
-    sa.Interval: _int_d,
+        sa.String: _string_d,
 
-    sa.Date: _date_d,
-    sa.DateTime: _datetime_d,
-    sa.Time: _time_d,
-}
+        sa.Numeric: _numeric_d,
+        sa.Integer: _int_d,
+        sa.Interval: _int_d,
 
+        sa.Date: fields.Date().deserialize,
+        sa.DateTime: fields.DateTime().deserialize,
+        sa.Time: fields.Time().deserialize,
+    }
+    for col_type, deserialize in defaults.items():
+        deserializers.setdefault(col_type, deserialize)
+    # the fallback for unknown types
+    deserializers.setdefault(None, _string_d)
 
-def deserialize_value_for_column(column, value=None):
-    deserialize = _string_d
 
+def get_deserializer(column):
+    if None not in deserializers:
+        _load_deserializers()
     for col_type in getmro(type(column.type)):
         if col_type in deserializers:
-            deserialize = deserializers[col_type]
-            break
+            return deserializers[col_type]
+    return deserializers[None]
 
-    return deserialize(value)
+
+def deserialize_value_for_column(column, value=None):
+    return get_deserializer(column)(value)
 
 
 def get_matchers(column):
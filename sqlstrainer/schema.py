@@ -1,6 +1,20 @@
-from sqlstrainer.match import column_matcher, deserialize_value_for_column
+"""Validates filter data and compiles it into SQL criteria
+
+:class:`CompiledSchema` is the default, :class:`StrainerSchema` is the original
+marshmallow schema and can still be passed to ``Strainer(schema=StrainerSchema)``.
+Both load a list of filter dicts into ``(filters, errors)``.
+
+.. autoclass:: CompiledSchema
+    :members:
+
+.. autoclass:: StrainerSchema
+"""
+from time import time
+from sqlstrainer import instrument
+from sqlstrainer.match import column_matcher, deserialize_value_for_column, get_deserializer
 from marshmallow import Schema, UnmarshallingError, ValidationError
 from marshmallow import fields
+from sqlstrainer._compat import string_types, text_type
 from sqlalchemy import or_ as sql_or, and_ as sql_and, not_ as sql_not
 from functools import reduce
 
@@ -45,24 +59,28 @@ class StrainerSchema(Schema):
             column_filter = column_matcher(column, data.get('action', 'contains'))
         except KeyError:
             return data
-        values = data.get('values', None)
-        print(values)
-        if not values:
-            f = column_filter(column, None)
-        else:
-            reduce = lambda *args: args[0]
-            if len(values) > 1:
-                if data.get('find', 'any') != 'any':
-                    reduce = sql_and
-                else:
-                    reduce = sql_or
-            f = reduce(*(column_filter(column, x) for x in values))
-        if data.get('not_'):
-            f = sql_not(f)
-        data['filter'] = f
+        data['filter'] = _make_filter(column, column_filter, data)
         return data
 
 
+def _make_filter(column, column_filter, data):
+    """combines the matcher criteria for each value"""
+    values = data.get('values', None)
+    if not values:
+        f = column_filter(column, None)
+    else:
+        reduce = lambda *args: args[0]
+        if len(values) > 1:
+            if data.get('find', 'any') != 'any':
+                reduce = sql_and
+            else:
+                reduce = sql_or
+        f = reduce(*(column_filter(column, x) for x in values))
+    if data.get('not'):
+        f = sql_not(f)
+    return f
+
+
 @StrainerSchema.validator
 def validate_filter(schema, data):
     strainer = schema._strainer
@@ -99,3 +117,169 @@ class FilterValueField(fields.Field):
             'required': set(),
             'optional': set()
         }
+
+
+_bool_d = fields.Boolean().deserialize
+
+_MISSING = 'Missing data for required field.'
+_INVALID_CHOICE = '{0!r} is not a valid choice for this field.'
+_INVALID_FILTER = 'Schema validator validate_filter({0!r}) is False'
+_INVALID_TYPE = 'Data must be a dict, got a {0}'
+_NO_VALUES = ('empty', 'notempty')
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, string_types):
+        return value
+    return text_type(value)
+
+
+class CompiledSchema(object):
+    """Single pass replacement for :class:`StrainerSchema`
+
+    Each entry is read once.  A name and action are resolved to column, matcher and
+    deserializer the first time they are seen and reused for every later entry and
+    :meth:`Strainer.build` call, except for ``cache_expression=False`` hybrids
+    which are resolved again for every entry.  Unknown names and actions are not
+    cached, so clients cannot grow the cache with made up names.  Filters and errors match :class:`StrainerSchema`,
+    except that invalid entries are left out of the filters instead of being returned
+    half built.
+    """
+
+    def __init__(self, strainer):
+        self._strainer = strainer
+        self._resolved = {}
+
+    def resolve(self, name, action='contains'):
+        """(column, matcher, deserializer) for a filter name and action, None if invalid"""
+        key = (name, action)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+        resolved = None
+        cache = False
+        try:
+            strainer_column = self._strainer.get(name)
+            column = strainer_column.column
+            if column is not None:
+                resolved = (column, column_matcher(column, action), get_deserializer(column))
+                cache = not getattr(strainer_column, 'dynamic', False)
+        except (KeyError, AttributeError):
+            pass
+        if cache:
+            self._resolved[key] = resolved
+        return resolved
+
+    def validate_entry(self, entry, errors):
+        """validates and deserializes a single filter dict without building criteria
+
+        :param entry: filter data
+        :param errors: dict that field and schema errors are appended to
+        :return: filter dict or None when invalid
+        """
+        if not isinstance(entry, dict):
+            errors.setdefault('_schema', []).append(_INVALID_TYPE.format(type(entry).__name__))
+            return None
+
+        data = {}
+        valid = True
+        if entry.get('name') is None:
+            errors.setdefault('name', []).append(_MISSING)
+            valid = False
+        else:
+            data['name'] = _text(entry['name'])
+        if 'find' in entry:
+            data['find'] = entry['find']
+            if data['find'] not in ('any', 'all'):
+                errors.setdefault('find', []).append(_INVALID_CHOICE.format(data['find']))
+                valid = False
+        values = entry.get('values')
+        if values is not None:
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            data['values'] = values = [_text(v) for v in values]
+        if 'action' in entry:
+            data['action'] = _text(entry['action'])
+        if 'not_' in entry:
+            try:
+                data['not'] = _bool_d(entry['not_'])
+            except (UnmarshallingError, ValidationError) as e:
+                errors.setdefault('not_', []).append(text_type(e))
+                valid = False
+
+        resolved = None
+        if 'name' in data:
+            action = data.get('action', 'contains')
+            resolved = self.resolve(data['name'], action)
+            if resolved is not None and action not in _NO_VALUES:
+                deserialize = resolved[2]
+                try:
+                    if not values:
+                        raise ValidationError('values required')
+                    values = [deserialize(v) for v in values]
+                except (UnmarshallingError, ValidationError):
+                    resolved = None
+        if resolved is None:
+            errors.setdefault('_schema', []).append(_INVALID_FILTER.format(data))
+            return None
+        if not valid:
+            return None
+
+        if action not in _NO_VALUES:
+            data['values'] = values
+        return data
+
+    def compile_entry(self, data):
+        """adds the ``filter`` criterion to a filter dict from :meth:`validate_entry`"""
+        column, column_filter, _ = self.resolve(data['name'], data.get('action', 'contains'))
+        data['filter'] = _make_filter(column, column_filter, data)
+        return data
+
+    def load_entry(self, entry, errors):
+        """validates and compiles a single filter dict
+
+        :param entry: filter data
+        :param errors: dict that field and schema errors are appended to
+        :return: filter dict with its ``filter`` criterion or None when invalid
+        """
+        data = self.validate_entry(entry, errors)
+        if data is not None:
+            return self.compile_entry(data)
+
+    def load(self, data):
+        """validates and compiles a list of filter dicts
+
+        :return: (filters, errors)
+        """
+        if instrument.listeners:
+            return self._load_instrumented(data)
+        filters = []
+        errors = {}
+        for entry in data:
+            f = self.load_entry(entry, errors)
+            if f is not None:
+                filters.append(f)
+        return filters, errors
+
+    def _load_instrumented(self, data):
+        """load() in two passes so validation and compilation are timed apart"""
+        errors = {}
+        entries = 0
+        validated = []
+        start = time()
+        for entry in data:
+            entries += 1
+            f = self.validate_entry(entry, errors)
+            if f is not None:
+                validated.append(f)
+        compiled = time()
+        filters = [self.compile_entry(f) for f in validated]
+        end = time()
+        mapper = self._strainer.base
+        fingerprint = instrument.fingerprint(filters)
+        instrument.emit('validate', compiled - start, mapper, fingerprint, entries=entries)
+        instrument.emit('compile', end - compiled, mapper, fingerprint, filters=len(filters))
+        return filters, errors
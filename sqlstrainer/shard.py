@@ -0,0 +1,225 @@
+"""Runs one strained query on several shards and merges the results
+
+Shards are engines (or sessions, their bind is used) with identical schemas.
+Every shard runs in its own thread, session and connection.
+
+.. code::
+
+    shards = FanOut([engine_a, engine_b, engine_c])
+    strained, errors = customer_strainer.build(request_data)
+
+    query = session.query(Customer)
+    top = list(shards.iter(strained, query, order_by=[Customer.last_name, Customer.customer_id], limit=20))
+    total = shards.count(strained, query)
+    genders = shards.facet(strained, query, 'gender')
+
+Ordered results are merged while they stream in, a k-way merge on the sort keys
+with at most two batches buffered per shard.  ``limit + offset`` is pushed down
+to every shard, the offset is applied after the merge.  NULLs sort first
+ascending and last descending.  That is the default of SQLite, MySQL and SQL
+Server, other dialects (PostgreSQL, Oracle, ...) get explicit ``NULLS FIRST`` /
+``NULLS LAST`` in each shard's ORDER BY so it matches the merge.
+
+.. autoclass:: FanOut
+    :members:
+"""
+import heapq
+import threading
+from collections import OrderedDict
+from itertools import islice
+
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import UnmappedColumnError
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import UnaryExpression
+
+from sqlstrainer._compat import queue
+from sqlstrainer.strainer import _all, _count, _run_in_session, _thread_pool
+
+__author__ = 'Douglas MacDougall <douglas.macdougall@moesol.com>'
+
+_DONE = object()
+
+
+class _Failure(object):
+    def __init__(self, error):
+        self.error = error
+
+
+class _SortKey(object):
+    """sort values of a row, compared like the ORDER BY they came from"""
+    __slots__ = ('values', 'descending')
+
+    def __init__(self, values, descending):
+        self.values = values
+        self.descending = descending
+
+    def __eq__(self, other):
+        return self.values == other.values
+
+    def __lt__(self, other):
+        for a, b, desc in zip(self.values, other.values, self.descending):
+            if a == b:
+                continue
+            if a is None:
+                return not desc
+            if b is None:
+                return desc
+            return a > b if desc else a < b
+        return False
+
+
+def _sort_columns(order_by, mapper):
+    """[(attribute key, descending)] of a list of attributes and desc() expressions
+
+    Each is resolved to the attribute of `mapper` mapping its column, rows are
+    merged on that attribute.
+
+    :raises ValueError: not a column of the base entity
+    """
+    columns = []
+    for c in order_by:
+        desc = isinstance(c, UnaryExpression) and c.modifier is operators.desc_op
+        if isinstance(c, UnaryExpression):
+            c = c.element
+        clause = getattr(c, '__clause_element__', None)
+        column = clause() if clause is not None else c
+        try:
+            prop = mapper.get_property_by_column(column)
+        except UnmappedColumnError:
+            raise ValueError('cannot merge shards on {0}, not a column of {1}'.format(c, mapper))
+        columns.append((prop.key, desc))
+    return columns
+
+
+def _shard_order(order_by, dialect):
+    """ORDER BY for each shard, NULLs placed where :class:`_SortKey` expects them"""
+    if dialect in FanOut.nulls_low_dialects:
+        return list(order_by)
+    order = []
+    for c in order_by:
+        if isinstance(c, UnaryExpression) and c.modifier is operators.desc_op:
+            order.append(c.nullslast())
+        else:
+            order.append(c.asc().nullsfirst())
+    return order
+
+
+def _put(out, item, stop):
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _produce(bind, query, batch_size, out, stop):
+    """streams the rows of one shard into `out` in batches"""
+    session = Session(bind=bind)
+    try:
+        rows = iter(query.with_session(session).yield_per(batch_size))
+        while not stop.is_set():
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            if not _put(out, batch, stop):
+                return
+        _put(out, _DONE, stop)
+    except Exception as e:
+        _put(out, _Failure(e), stop)
+    finally:
+        session.close()
+
+
+def _consume(out, producers=1):
+    """yields rows from a queue until every producer is done"""
+    while producers:
+        item = out.get()
+        if item is _DONE:
+            producers -= 1
+        elif isinstance(item, _Failure):
+            raise item.error
+        else:
+            for row in item:
+                yield row
+
+
+def _keyed(rows, shard, columns):
+    keys = [k for k, _ in columns]
+    descending = [d for _, d in columns]
+    for seq, row in enumerate(rows):
+        yield _SortKey([getattr(row, k) for k in keys], descending), shard, seq, row
+
+
+class FanOut(object):
+    """Fans strained queries out to shards
+
+    :param binds: engines or sessions of the shards
+    """
+
+    """dialects that sort NULLs first ascending and last descending by default"""
+    nulls_low_dialects = ('sqlite', 'mysql', 'mssql')
+
+    def __init__(self, binds):
+        self.binds = [getattr(b, 'bind', None) or b for b in binds]
+
+    def iter(self, strained, query, order_by=None, limit=None, offset=0, batch_size=1000):
+        """yields the strained rows of every shard
+
+        :param strained: StrainerFilter from :meth:`Strainer.build`
+        :param query: unstrained query of the base entity
+        :param order_by: base entity column attributes or ``desc()`` of them to
+            merge on, rows arrive in no particular order without
+        :param limit: rows to return, pushed down as ``limit + offset``
+        :param batch_size: rows fetched from a shard at a time
+        :raises ValueError: an `order_by` element is not a base entity column
+        """
+        columns = _sort_columns(order_by, strained.strainer.base) if order_by else None
+        query = strained.strain(query)
+        if order_by:
+            query = query.order_by(*_shard_order(order_by, self.binds[0].dialect.name))
+        if limit is not None:
+            query = query.limit(limit + offset)
+        stop = threading.Event()
+        if order_by:
+            queues = [queue.Queue(2) for _ in self.binds]
+        else:
+            queues = [queue.Queue(2 * len(self.binds))] * len(self.binds)
+        for bind, out in zip(self.binds, queues):
+            t = threading.Thread(target=_produce, args=(bind, query, batch_size, out, stop))
+            t.daemon = True
+            t.start()
+        try:
+            if order_by:
+                streams = [_keyed(_consume(out), i, columns) for i, out in enumerate(queues)]
+                rows = (row for _, _, _, row in heapq.merge(*streams))
+            else:
+                rows = _consume(queues[0], len(self.binds))
+            end = None if limit is None else offset + limit
+            for row in islice(rows, offset, end):
+                yield row
+        finally:
+            stop.set()
+
+    def all(self, strained, query, order_by=None, limit=None, offset=0):
+        """list of :meth:`iter`"""
+        return list(self.iter(strained, query, order_by, limit, offset))
+
+    def _map(self, query, fetch):
+        pool = _thread_pool()
+        results = [pool.apply_async(_run_in_session, (bind, query, fetch)) for bind in self.binds]
+        return [r.get() for r in results]
+
+    def count(self, strained, query):
+        """sum of the strained counts of every shard"""
+        return sum(self._map(strained.strain(query).order_by(None), _count))
+
+    def facet(self, strained, query, key):
+        """summed (value, count) of a column over every shard, most common first"""
+        totals = OrderedDict()
+        for rows in self._map(strained.facet(query, key), _all):
+            for value, n in rows:
+                totals[value] = totals.get(value, 0) + n
+        return sorted(totals.items(), key=lambda item: -item[1])
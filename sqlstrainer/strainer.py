@@ -14,18 +14,87 @@ else:
     other_q = session.query(MyModel.id, sum(Other.value)).group_by(MyModel.id).join(MyModel.other)
     query = strainer.strain(other_q)
 
+    # or evaluate the filter once, as a CTE of matching ids, for any number of queries
+    ids = strainer.ids(cte=True)
+    other_q = strainer.join_ids(session.query(MyModel.id, sum(Other.value)), ids)
+
 .. autoclass:: Strainer
     :members:
 
 """
-from sqlalchemy import or_ as sql_or
+import threading
+from collections import OrderedDict
+from time import time
+import sqlalchemy as sa
+from sqlalchemy import or_ as sql_or, and_ as sql_and, not_ as sql_not
 from sqlalchemy.ext.hybrid import hybrid_property
-from six import string_types
-from sqlstrainer.mapper import StrainerMap
-from sqlstrainer.schema import StrainerSchema
+from sqlalchemy.orm import Query, Session, aliased, join as orm_join
+from sqlstrainer._compat import string_types, text_type, unichr
+from sqlstrainer.mapper import StrainerMap, _LRUCache
+from sqlstrainer import instrument
+from sqlstrainer.view import StrainerView, VIEW_DISTINCT, VIEW_NESTED, _make_label
 
-"""strainer map"""
+"""default strainer map, see :func:`default_map`"""
 _dbmap = None
+_dbmap_lock = threading.Lock()
+
+"""strainer shared with forked build_many workers"""
+_pool_strainer = None
+
+"""threads running the queries of :meth:`StrainerFilter.page`"""
+page_threads = 8
+_page_pool = None
+_page_pool_lock = threading.Lock()
+
+
+class StrainerError(Exception):
+    """Filter data failed validation in strict mode"""
+
+    def __init__(self, errors):
+        super(StrainerError, self).__init__(errors)
+        self.errors = errors
+
+
+"""actions that make a filter negative, see :attr:`Strainer.anti_join`"""
+_NEGATIVE_ACTIONS = ('notcontains', 'isnot', 'ne')
+
+
+def _text_of(value):
+    return value if isinstance(value, string_types) else text_type(value)
+
+
+def _merge_errors(errors, more):
+    if not more:
+        return errors
+    errors = dict(errors or {})
+    for key, messages in more.items():
+        errors[key] = list(errors.get(key, ())) + messages
+    return errors
+
+
+def default_map():
+    """StrainerMap of every mapper, built once on first use
+
+    Thread safe, concurrent first callers wait for a single build.
+    """
+    global _dbmap
+    if _dbmap is None:
+        with _dbmap_lock:
+            if _dbmap is None:
+                _dbmap = StrainerMap()
+    return _dbmap
+
+
+def _validate_chunk(chunk):
+    """build_many worker: validates filter sets without building SQL criteria"""
+    loader = _pool_strainer._loader
+    results = []
+    for data in chunk:
+        errors = {}
+        entries = [loader.validate_entry(entry, errors) for entry in data]
+        results.append(([e for e in entries if e is not None], errors))
+    return results
+
 
 def strainer_property(**info):
     """very simple decorator to markup hybrid_property with info similar to Column(info={})
@@ -40,6 +109,9 @@ def strainer_property(**info):
     def full_name(self):
         return self.first + ' ' + self.last
 
+    Pass ``cache_expression=False`` when the class expression depends on runtime
+    state, otherwise it is built once and reused.
+
     :param info: kwargs style dict for strainer information
     :return: hybrid_property decorator
     """
@@ -60,9 +132,10 @@ class _StrainerJoin(object):
     def __init__(self, name, base, join, flags):
         self._base = base
         self._name = name
-        self._mapper = _dbmap.to_mapper(join[-1])
+        self._mapper = StrainerMap.to_mapper(join[-1])
         self._flags = flags
         self._join = join
+        self._alias = None
 
     def field_name(self, column):
         return self.tablename + '.' + column.split('.')[-1]
@@ -82,44 +155,521 @@ class _StrainerJoin(object):
     def flags(self):
         return self._flags
 
+    is_aggregate = False
+
     @property
     def join(self):
         return self._join
 
+    @property
+    def uselist(self):
+        """True when any hop of the join is to-many"""
+        return any(getattr(getattr(r, 'property', None), 'uselist', False) for r in self._join)
+
+    def _inner(self, *columns):
+        if self._alias is None:
+            self._alias = aliased(self._base.entity)
+        alias = self._alias
+        first = self._join[0]
+        hop = getattr(alias, first.key)
+        if getattr(first, '_of_type', None) is not None:
+            hop = hop.of_type(first._of_type)
+        query = Query(list(columns)).select_from(alias).join(hop)
+        for hop in self._join[1:]:
+            query = query.join(hop)
+        if self._flags:
+            query = query.filter(*self._flags)
+        return query
+
+    def not_exists(self, criterion):
+        """NOT EXISTS a related row matching `criterion`, correlated to the base row"""
+        inner = self._inner()
+        alias = self._alias
+        pk = [getattr(alias, c.key) == getattr(self._base.entity, c.key) for c in self._base.primary_key]
+        return ~inner.filter(sql_and(*pk), criterion).correlate(self._base.entity).exists()
+
+    def matching_ids(self, criterion, name):
+        """subquery of the primary keys of base rows with a related row matching `criterion`"""
+        inner = self._inner()
+        alias = self._alias
+        inner = inner.add_columns(*[getattr(alias, c.key) for c in self._base.primary_key])
+        return inner.filter(criterion).distinct().subquery(name)
+
+    def correlated(self, expression):
+        """correlated scalar subquery computing `expression` for each base row
+
+        Only the base table is correlated, the relative may be joined to the
+        enclosing query as well.
+        """
+        inner = self._inner(expression)
+        alias = self._alias
+        pk = [getattr(alias, c.key) == getattr(self._base.entity, c.key) for c in self._base.primary_key]
+        return inner.filter(sql_and(*pk)).correlate(self._base.entity).as_scalar()
+
+
+class _AggregateColumn(object):
+    """Aggregate of a relative, looks like a StrainerColumn to the schema and views"""
+
+    viewable = True
+    filterable = True
+
+    def __init__(self, aggregate, name, expression, label=None):
+        self.mapper = aggregate.mapper
+        self.name = name
+        self.label = label if label is not None else _make_label(name)
+        self.expression = expression
+        self.scalar = aggregate.correlated(expression)
+        self.column = expression if aggregate.strategy == 'having' else self.scalar
+
+    def __repr__(self):
+        return '<AggregateColumn {0}>'.format(self.name)
+
+
+class _StrainerAggregate(_StrainerJoin):
+    """Aggregates (count, sum, min, max, avg) over a relationship path
+
+    Never joined to the strained query, computed in SQL with either
+
+    * ``subquery``: a correlated scalar subquery per aggregate, filters go in WHERE
+    * ``having``: filters become ``base.id IN (SELECT ... GROUP BY base.id HAVING ...)``
+
+    ``having`` does not match base rows without any related rows.
+    """
+
+    functions = ('count', 'sum', 'min', 'max', 'avg')
+    is_aggregate = True
+
+    def __init__(self, name, base, join, flags, aggregate, strategy='subquery', dbmap=None):
+        super(_StrainerAggregate, self).__init__(name, base, join, flags)
+        self._dbmap = dbmap if dbmap is not None else default_map()
+        if strategy not in ('subquery', 'having'):
+            raise ValueError(strategy)
+        if strategy == 'having' and len(base.primary_key) != 1:
+            raise ValueError('having strategy requires a single column primary key')
+        for hop in join:
+            if getattr(hop, 'property', None) is None:
+                raise ValueError('cannot aggregate over {0}'.format(hop))
+        self.strategy = strategy
+        self._columns = {}
+        for column_name, spec in aggregate.items():
+            label = None
+            if isinstance(spec, dict):
+                label = spec.get('label')
+                spec = (spec['function'], spec.get('column'))
+            if isinstance(spec, string_types):
+                spec = (spec, None)
+            fname, target = spec
+            if fname not in self.functions:
+                raise ValueError('unknown aggregate {0}'.format(fname))
+            self._columns[column_name] = _AggregateColumn(
+                self, column_name, self._aggregate(fname, target), label)
+
+    @property
+    def mapper(self):
+        return self._mapper
+
+    @property
+    def columns(self):
+        return self._columns
+
+    @property
+    def uselist(self):
+        return False
+
+    def _aggregate(self, fname, target):
+        if target is None:
+            if fname != 'count':
+                raise ValueError('{0} needs a column'.format(fname))
+            return sa.func.count(self._mapper.primary_key[0])
+        col = self._dbmap[self.tablename + '.' + target].column
+        if fname == 'count':
+            return sa.func.count(col)
+        if fname == 'avg':
+            return sa.func.avg(col, type_=sa.Float)
+        return getattr(sa.func, fname)(col, type_=col.type)
+
+    def having(self, criterion):
+        """filters base rows on aggregates with GROUP BY ... HAVING"""
+        pk = self._base.primary_key[0].key
+        grouped = self._inner()
+        alias_pk = getattr(self._alias, pk)
+        grouped = grouped.add_columns(alias_pk).group_by(alias_pk).having(criterion)
+        return getattr(self._base.entity, pk).in_(grouped.subquery())
+
 
 class StrainerFilter(object):
 
-    def __init__(self, strainer, filters):
+    def __init__(self, strainer, filters, rejected=False):
         self._strainer = strainer
         self._filters = filters
+        self._rejected = rejected
+        self._fingerprint = None
+        self.diagnostics = strainer.diagnostics
 
-    def strain(self, query):
-        if not self._filters:
-            return query
-        filters = []
+    @property
+    def fingerprint(self):
+        """hash of the filter shape, equal for filters differing only in values"""
+        if self._fingerprint is None:
+            self._fingerprint = instrument.fingerprint(self._filters)
+        return self._fingerprint
+
+    @property
+    def strainer(self):
+        return self._strainer
+
+    @property
+    def filters(self):
+        """validated filter dicts, each with its ``filter`` criterion"""
+        return self._filters or []
+
+    @property
+    def rejected(self):
+        """True when the request was turned away by the cost model, it matches no rows"""
+        return self._rejected
+
+    @property
+    def tables(self):
+        """names of the relatives the filters need joined"""
         tables = set()
         basename = self._strainer.tablename
-        for f in self._filters:
-            filters.append(f['filter'])
+        relatives = self._strainer.relatives
+        for f in self._filters or ():
             tbl, _ = self._strainer.split_name(f['name'])
-            if tbl != basename:
+            if tbl != basename and not relatives[tbl].is_aggregate and self._anti(f) is None:
                 tables.add(tbl)
+        return tables
+
+    @property
+    def joins_many(self):
+        """True when a filter joins a to-many relative, repeating base rows"""
+        relatives = self._strainer.relatives
+        return any(relatives[t].uselist for t in self.tables)
+
+    def _anti(self, f):
+        """to-many relative a negative filter is anti-joined to, None when joined as usual"""
+        strainer = self._strainer
+        # not_ on a negative action is a positive filter again
+        if not strainer.anti_join or bool(f.get('not')) == (f.get('action') in _NEGATIVE_ACTIONS):
+            return None
+        tbl, _ = strainer.split_name(f['name'])
+        relative = strainer.relatives.get(tbl)
+        if relative is None or relative.is_aggregate or not relative.uselist:
+            return None
+        return relative
+
+    def strain(self, query, joined=None, distinct=True):
+        """applies the filters and their joins to a query
+
+        Works on an ORM ``Query`` as well as on a Core/2.0 style ``select()`` of the
+        base entity, see :mod:`sqlstrainer.aio` to run the latter on an ``AsyncSession``.
 
+        The filtered query is DISTINCT.  With ``distinct=False`` it only is when a
+        to-many relative is joined, which is enough for queries of whole base rows
+        (base and to-one joins cannot repeat them) and lets the database stream
+        or use an index for ORDER BY.  Column queries may repeat values then.
+
+        :param query: Query or Select to filter
+        :param joined: names of relatives already joined to the query
+        :param distinct: False to only add DISTINCT for joined to-many relatives
+        :return: filtered query
+        """
+        return self._strain(query, joined, distinct=distinct)
+
+    def _strain(self, query, joined=None, extra=(), distinct=True):
+        if self._rejected:
+            # never fall back to an unfiltered query
+            criterion = sa.false()
+            return query.filter(criterion) if isinstance(query, Query) else query.where(criterion)
+        if not self._filters and not extra:
+            return query
+        start = time() if instrument.listeners else None
+        is_query = isinstance(query, Query)
+        outer_anti = (self._strainer.anti_join == 'outerjoin' and self._strainer.restrictive and
+                      (is_query or hasattr(query, 'join_from')))
+        filters = []
+        anti_joins = []
+        for f in self._filters:
+            tbl, _ = self._strainer.split_name(f['name'])
+            relative = self._strainer.relatives.get(tbl)
+            anti = self._anti(f)
+            if anti is not None:
+                # no related row may fail the filter
+                if outer_anti:
+                    anti_joins.append((anti, sql_not(f['filter'])))
+                else:
+                    filters.append(anti.not_exists(sql_not(f['filter'])))
+            elif relative is not None and relative.is_aggregate and relative.strategy == 'having':
+                filters.append(relative.having(f['filter']))
+            else:
+                filters.append(f['filter'])
+        tables = self.tables
+        tables.update(extra)
+        if joined:
+            tables.difference_update(joined)
+
+        if is_query:
+            query = self._strain_query(query, filters, tables)
+        else:
+            query = self._strain_select(query, filters, tables)
+
+        pk = self._strainer.base.primary_key
+        for i, (relative, criterion) in enumerate(anti_joins):
+            matched = relative.matching_ids(criterion, '{0}_anti_{1}'.format(relative.name, i))
+            query = query.outerjoin(matched, sql_and(*[matched.c[c.key] == c for c in pk]))
+            is_null = matched.c[pk[0].key].is_(None)
+            query = query.filter(is_null) if is_query else query.where(is_null)
+
+        if not distinct:
+            # only joined to-many relatives repeat base rows
+            distinct = any(self._strainer.relatives[t].uselist for t in tables)
+        if distinct:
+            query = query.distinct()
+        if start is not None:
+            base = self._strainer.base
+            query = instrument.tag_query(query, base, self.fingerprint)
+            instrument.emit('strain', time() - start, base, self.fingerprint, filters=len(filters),
+                            joins=sum(len(self._strainer.relatives[t].join) for t in tables),
+                            distinct=int(distinct))
+        if self.diagnostics is not None:
+            query = self.diagnostics.tag(query, self._strainer.base, self.fingerprint)
+        return query
+
+    def _strain_query(self, query, filters, tables):
         join_type = 'join'
         if self._strainer.restrictive:
             query = query.filter(*filters)
-        else:
+        elif filters:
             query = query.filter(sql_or(*filters))
             join_type = 'outerjoin'
             # todo: validate repeated join relations act as set
 
-        for tbl in tables:
+        for tbl in sorted(tables):
             query = getattr(query, join_type)(*self._strainer.relatives[tbl].join)
             flags = self._strainer.relatives[tbl].flags
             if flags:
                 query = query.filter(*flags)
+        return query
+
+    def _strain_select(self, select, filters, tables):
+        outer = not self._strainer.restrictive
+        if filters:
+            select = select.where(sql_or(*filters) if outer else sql_and(*filters))
+        # SQLAlchemy 1.4+ joins relationships on the statement, before that
+        # the joins are built with orm.join and selected from
+        statement_join = hasattr(select, 'join_from')
+        target = self._strainer.base.entity
+        seen = set()
+        for tbl in sorted(tables):
+            relative = self._strainer.relatives[tbl]
+            for i, hop in enumerate(relative.join):
+                # relatives sharing hops join them once
+                prefix = tuple(relative.join[:i + 1])
+                if prefix in seen:
+                    continue
+                seen.add(prefix)
+                if statement_join:
+                    select = select.join(hop, isouter=outer)
+                else:
+                    target = orm_join(target, StrainerMap.to_mapper(hop), hop, isouter=outer)
+            if relative.flags:
+                select = select.where(sql_and(*relative.flags))
+        if not statement_join and seen:
+            select = select.select_from(target)
+        return select
 
-        return query.distinct()
+    def order_by(self, query, keys, limit=None, offset=None, joined=None):
+        """strains a query and sorts it on base and relative columns
+
+        Keys are filter style names, ``-`` in front sorts descending::
+
+            strained.order_by(session.query(Customer), ['parent.last_name', '-current_balance'], limit=20)
+
+        Relatives joined for the filters are sorted on directly, other to-one
+        relatives are outer joined.  To-many relatives sort on the smallest (or
+        for descending the largest) related value, computed in a correlated
+        subquery so base rows are neither repeated nor dropped.  Filters on
+        to-many relatives are applied with :meth:`semi_join`, so the sorted
+        statement has no DISTINCT.  The primary key ends the ORDER BY (unless
+        already sorted on) and LIMIT goes on the same statement, so the database
+        can stop at the first rows of an index scan or use a top-N sort.
+
+        :param query: Query or select() of the base entity
+        :param keys: list of ``[-]relative.column`` names
+        :param joined: names of relatives already joined to the query
+        :return: strained, sorted and limited query
+        """
+        strainer = self._strainer
+        if self.joins_many:
+            query = self.semi_join(query)
+            present = set(joined or ())
+        else:
+            query = self.strain(query, joined, distinct=False)
+            present = self.tables.union(joined or ())
+        can_join = isinstance(query, Query) or hasattr(query, 'join_from')
+        order = []
+        sorted_on = set()
+        for key in keys:
+            descending = key.startswith('-')
+            name = key.lstrip('-')
+            tbl, attr = strainer.split_name(name)
+            column = strainer.get(name)
+            expression = column.column
+            if tbl == strainer.tablename:
+                sorted_on.add(attr)
+            else:
+                relative = strainer.relatives[tbl]
+                if relative.is_aggregate:
+                    expression = column.scalar
+                elif relative.uselist:
+                    expression = relative.correlated((sa.func.max if descending else sa.func.min)(expression))
+                elif tbl not in present:
+                    if can_join and not relative.flags:
+                        for hop in relative.join:
+                            query = query.outerjoin(hop)
+                        present.add(tbl)
+                    else:
+                        expression = relative.correlated(expression)
+            order.append(expression.desc() if descending else expression)
+        base = strainer.base
+        order.extend(c for c in base.primary_key if base.get_property_by_column(c).key not in sorted_on)
+        query = query.order_by(*order)
+        if limit is not None:
+            query = query.limit(limit)
+        if offset:
+            query = query.offset(offset)
+        return query
+
+    def ids(self, name=None, cte=False):
+        """subquery (or CTE) of the primary keys of the matching base rows
+
+        The joins and DISTINCT run once inside it, queries that join against it
+        with :meth:`join_ids` only join one more table.
+
+        :param name: alias name, default ``<table>_ids``
+        :param cte: build a ``WITH`` common table expression instead of a subquery
+        """
+        base = self._strainer.base
+        name = name or self._strainer.tablename + '_ids'
+        query = self.strain(Query(list(base.primary_key)).select_from(base.entity), distinct=False)
+        return query.cte(name) if cte else query.subquery(name)
+
+    def semi_join(self, query, ids=None):
+        """restricts a query of the base entity to the matching rows with
+        ``IN`` (:meth:`ids`) on the primary key, nothing is joined to it and
+        base rows are not repeated
+
+        :param query: Query or select() that includes the base table
+        :param ids: result of :meth:`ids`, a new subquery by default
+        """
+        if ids is None:
+            ids = self.ids()
+        pk = self._strainer.base.primary_key
+        if len(pk) == 1:
+            criterion = pk[0].in_(ids)
+        else:
+            criterion = sa.tuple_(*pk).in_(ids)
+        return query.filter(criterion) if isinstance(query, Query) else query.where(criterion)
+
+    def join_ids(self, query, ids=None):
+        """joins a query of the base entity against :meth:`ids`
+
+        :param query: Query or select() that includes the base table
+        :param ids: result of :meth:`ids`, a new subquery by default
+        :return: query restricted to the matching base rows
+        """
+        if ids is None:
+            ids = self.ids()
+        onclause = sql_and(*[ids.corresponding_column(c) == c for c in self._strainer.base.primary_key])
+        if isinstance(query, Query):
+            return query.join(ids, onclause)
+        if hasattr(query, 'join_from'):
+            return query.join(ids, onclause)
+        return query.select_from(orm_join(self._strainer.base.entity, ids, onclause))
+
+    def facet(self, query, key):
+        """counts the matching base rows per value of a column
+
+        :param query: ``session.query(Base)`` or ``select()`` to turn into the facet query
+        :param key: filter style ``relative.column`` name
+        :return: query of (value, count) rows
+        """
+        strainer = self._strainer
+        column = strainer.get(key).column
+        tbl, _ = strainer.split_name(key)
+        entity = strainer.base.entity
+        count = sa.func.count(sa.distinct(strainer.base.primary_key[0]))
+        if isinstance(query, Query):
+            query = query.with_entities(column, count).select_from(entity)
+        elif hasattr(query, 'join_from'):
+            query = query.with_only_columns(column, count).select_from(entity)
+        else:
+            query = query.with_only_columns([column, count]).select_from(entity)
+        extra = (tbl,) if tbl != strainer.tablename else ()
+        return self._strain(query, extra=extra, distinct=False).group_by(column).order_by(None)
+
+    def page(self, query, bind, limit, offset=0, facets=None):
+        """runs the page, count and facet queries at the same time
+
+        Each query gets its own session and pooled connection from `bind` and runs
+        on a shared thread pool, so the latency is that of the slowest query.
+        Entities are returned detached, see :func:`sqlstrainer.aio.page` for
+        async engines.
+
+        >>> page = strained.page(session.query(Customer), engine, limit=20, facets=['gender'])
+        >>> page.items, page.total, page.facets['gender']
+
+        :param query: unstrained query of the base entity
+        :param bind: engine to run on
+        :param facets: ``relative.column`` names to count values of
+        :rtype: Page
+        """
+        strained = self.strain(query)
+        jobs = [(strained.limit(limit).offset(offset), _all),
+                (strained.order_by(None), _count)]
+        for key in facets or ():
+            jobs.append((self.facet(query, key), _all))
+        pool = _thread_pool()
+        results = [pool.apply_async(_run_in_session, (bind, q, fetch)) for q, fetch in jobs]
+        results = [r.get() for r in results]
+        return Page(results[0], results[1],
+                    OrderedDict((key, results[i + 2]) for i, key in enumerate(facets or ())))
+
+
+class Page(object):
+    """Rows of one page, the total number of rows and facet counts"""
+    __slots__ = ('items', 'total', 'facets')
+
+    def __init__(self, items, total, facets):
+        self.items = items
+        self.total = total
+        self.facets = facets
+
+
+def _all(query):
+    return query.all()
+
+
+def _count(query):
+    return query.count()
+
+
+def _run_in_session(bind, query, fetch):
+    session = Session(bind=bind)
+    try:
+        return fetch(query.with_session(session))
+    finally:
+        session.close()
+
+
+def _thread_pool():
+    """thread pool shared by :meth:`StrainerFilter.page`, created on first use"""
+    global _page_pool
+    if _page_pool is None:
+        with _page_pool_lock:
+            if _page_pool is None:
+                from multiprocessing.pool import ThreadPool
+                _page_pool = ThreadPool(page_threads)
+    return _page_pool
 
 
 class Strainer(object):
@@ -129,31 +679,61 @@ class Strainer(object):
     """
 
     restrictive = True
-    VIEW_DISTINCT = 1
-    VIEW_NESTED = 2
+    """how negative filters (``notcontains``, ``isnot``, ``ne`` or ``not_``, not both) on
+    to-many relatives are compiled: ``exists`` for NOT EXISTS, ``outerjoin`` for
+    LEFT OUTER JOIN ... IS NULL, None to join and test each related row"""
+    anti_join = 'exists'
+    """:class:`sqlstrainer.diagnostics.SlowFilterLog` strained queries are timed into, None for off"""
+    diagnostics = None
+    """seconds suggestions are cached and prefixes cached per column"""
+    suggest_ttl = 60
+    suggest_cache_size = 256
+    VIEW_DISTINCT = VIEW_DISTINCT
+    VIEW_NESTED = VIEW_NESTED
 
-    def __init__(self, base, strict=False):
+    def __init__(self, base, strict=False, schema=None, dbmap=None, cost=None):
         """
         :param base: base entity - all joins originate from here
         :type base: Declarative or Mapper
         :param strict: Strict Mode : errors raise exceptions, default skip errors
         :type strict: bool
+        :param schema: filter schema class, default :class:`sqlstrainer.schema.CompiledSchema`,
+            :class:`sqlstrainer.schema.StrainerSchema` for the marshmallow schema
+        :param dbmap: StrainerMap to resolve names in, default :func:`default_map`.
+            Use ``StrainerMap.for_base(Base)`` to keep declarative bases apart
+        :type dbmap: StrainerMap
+        :param cost: budget requests are scored against before they are loaded
+        :type cost: sqlstrainer.cost.CostModel
         """
+        self._dbmap = dbmap
+        self.cost = cost
         self._relatives = {}
         self._base = base
+        self.strict = strict
+        self._schema = schema
+        self._loader = None
         self._filters = None
         self._exclude = set()
         self._to_relate = []
+        self._suggestions = {}
+        self._init_lock = threading.Lock()
         self._initialized = False
 
     def init(self):
-        global _dbmap
-        if not _dbmap:
-            _dbmap = StrainerMap()
-        self._base = _dbmap.to_mapper(self._base)
-        self._initialized = True
-        for r in self._to_relate:
-            self.relate(*r)
+        """resolves the base and the queued relatives, once
+
+        Shared strainers are initialized by whichever thread gets there first, the
+        others wait until every queued relative is in place.
+        """
+        with self._init_lock:
+            if self._initialized:
+                return
+            if self._dbmap is None:
+                self._dbmap = default_map()
+            self._base = self._dbmap.to_mapper(self._base)
+            for r in self._to_relate:
+                self._relate(*r)
+            self._initialized = True
 
     def __call__(self, *args, **kwargs):
         return self.build(args[0])
@@ -163,10 +743,20 @@ class Strainer(object):
         tbl, name = self.split_name(item)
 
         if tbl != self.tablename:
-            path = self._relatives[tbl].join
-            tbl = _dbmap.to_mapper(path[-1]).entity.__tablename__
+            relative = self._relatives[tbl]
+            if relative.is_aggregate:
+                return relative.columns[name]
+            tbl = relative.tablename
+
+        return self._dbmap[tbl + '.' + name]
+
+    @property
+    def base(self):
+        return self._base
 
-        return _dbmap[tbl + '.' + name]
+    @property
+    def dbmap(self):
+        return self._dbmap
 
     @property
     def tablename(self):
@@ -203,46 +793,228 @@ class Strainer(object):
         ** value ** - required for most
 
         :param data: list of data to filter on
-        :raises Error: when strict mode is enabled
+        :return: (StrainerFilter, errors)
+        :raises StrainerError: when strict mode is enabled and data is invalid
         """
         if not self._initialized:
             self.init()
-        filters, errors = StrainerSchema(self).load(data)
-        return StrainerFilter(self, filters), errors
+        if self._loader is None:
+            self._loader = self._new_loader()
+        start = time() if instrument.listeners else None
+        data, over_budget = self._within_budget(data)
+        if data is None:
+            filters, errors = [], over_budget
+        else:
+            filters, errors = self._loader.load(data)
+            if over_budget:
+                errors = _merge_errors(errors, over_budget)
+        strained = StrainerFilter(self, filters, rejected=data is None)
+        if start is not None:
+            values = [len(f.get('values') or ()) for f in filters]
+            instrument.emit('build', time() - start, self._base, strained.fingerprint,
+                            filters=len(filters), errors=sum(len(e) for e in (errors or {}).values()),
+                            values=sum(values), max_values=max(values or [0]))
+        if self.strict and errors:
+            raise StrainerError(errors)
+        return strained, errors
+
+    def build_many(self, datasets, processes=None, chunksize=100):
+        """builds filters for many sets of filter data at once
 
-    def relate(self, name, path, flags=None, exclude=None):
+        Column, matcher and deserializer resolution is shared by every set.  With
+        `processes` the sets are validated by a pool of forked workers and only
+        the SQL criteria are built in this process, which pays off for very large
+        batches only.
+
+        :param datasets: iterable of filter data lists, see :meth:`build`
+        :param processes: number of worker processes, default validates in process
+        :param chunksize: filter sets sent to a worker at a time
+        :return: list of (StrainerFilter, errors), also in strict mode
+        """
         if not self._initialized:
-            self._to_relate.append((name, path, flags, exclude))
-            return
+            self.init()
+        if self._loader is None:
+            self._loader = self._new_loader()
+        loader = self._loader
+
+        limited = [self._within_budget(data) for data in datasets]
+        datasets = [data or [] for data, _ in limited]
+
+        if not processes or not hasattr(loader, 'validate_entry'):
+            loaded = map(loader.load, datasets)
+        else:
+            loaded = self._validate_forked(datasets, processes, chunksize)
+        return [(StrainerFilter(self, filters, rejected=data is None), _merge_errors(errors, over_budget))
+                for (filters, errors), (data, over_budget) in zip(loaded, limited)]
+
+    def _validate_forked(self, datasets, processes, chunksize):
+        global _pool_strainer
+        loader = self._loader
+        import multiprocessing
+        chunks = [datasets[i:i + chunksize] for i in range(0, len(datasets), chunksize)]
+        _pool_strainer = self
+        try:
+            pool = multiprocessing.get_context('fork').Pool(processes)
+            try:
+                validated = pool.map(_validate_chunk, chunks)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            _pool_strainer = None
+
+        results = []
+        for chunk in validated:
+            for filters, errors in chunk:
+                results.append(([loader.compile_entry(f) for f in filters], errors))
+        return results
+
+    def _new_loader(self):
+        """instance of the filter schema, the validation machinery is imported on first use"""
+        schema = self._schema
+        if schema is None:
+            from sqlstrainer.schema import CompiledSchema as schema
+        return schema(self)
+
+    def _within_budget(self, data):
+        """applies the cost model, (data, errors)"""
+        if self.cost is None:
+            return data, None
+        return self.cost.apply(self, data)
+
+    def relate(self, name, path, flags=None, exclude=None, aggregate=None, strategy='subquery'):
+        """registers a relative reachable from the base through `path`
+
+        Columns of a relative are filtered and viewed as ``name.column``.
+
+        With `aggregate` the relative is not joined, instead each entry becomes an
+        aggregate column computed in SQL over the path::
+
+            strainer.relate('order_stats', 'orders', aggregate={
+                'count': 'count',
+                'total': ('sum', 'derived_order_value'),
+            })
+            strainer.build([{'name': 'order_stats.count', 'action': 'gt', 'values': [5]}])
+
+        :param name: relative name
+        :param path: dotted relationship path or list of relationships/models
+        :param flags: extra criteria for the relative
+        :param exclude: columns to exclude
+        :param aggregate: dict of column name to function name, (function, column)
+            or dict(function=, column=, label=)
+        :param strategy: ``subquery`` (correlated) or ``having`` (GROUP BY/HAVING) for aggregates
+        """
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    self._to_relate.append((name, path, flags, exclude, aggregate, strategy))
+                    return
+        self._relate(name, path, flags, exclude, aggregate, strategy)
+
+    def _relate(self, name, path, flags, exclude, aggregate, strategy):
         # todo: make an alias to name and use the alias for the column getter...
         if isinstance(path, string_types):
             parts = path.split('.')
             if not parts[0] == self.tablename:
                 path = self.tablename + '.' + path
-            join = _dbmap.join_from_dotted(path)
+            join = self._dbmap.join_from_dotted(path)
         else:
             # be forgiving (not sure if good/bad thing)
             try:
                 path = list(path)
-            except TypeError:
+            except (TypeError, NotImplementedError):
+                # instrumented attributes raise NotImplementedError on iteration
                 path = [path]
 
-            mapper = _dbmap.to_mapper(path[0])
+            mapper = self._dbmap.to_mapper(path[0])
             if mapper is not self._base:
                 path.insert(0, self._base)
-            join = _dbmap.join_path(path)
+            join = self._dbmap.join_path(path)
 
-        self._relatives[name] = _StrainerJoin(name, self._base, join, flags)
+        if aggregate:
+            self._relatives[name] = _StrainerAggregate(
+                name, self._base, join, flags, aggregate, strategy, self._dbmap)
+        else:
+            self._relatives[name] = _StrainerJoin(name, self._base, join, flags)
+        self._loader = None
         if exclude:
             self.exclude(exclude)
 
+    def view(self, keys, view_type=VIEW_DISTINCT):
+        """selects only the given columns instead of whole entities
+
+        Filters choose the base rows of the view, they do not narrow the rows of
+        a viewed relative: viewing ``orders.order_id`` with a filter on
+        ``orders.details`` lists every order of the matching customers, for
+        VIEW_DISTINCT and VIEW_NESTED alike.
+
+        :param keys: list of ``relative.column`` view keys
+        :param view_type: VIEW_DISTINCT or VIEW_NESTED
+        :rtype: StrainerView
+        """
+        return StrainerView(self, keys, view_type)
+
+    def suggest(self, session, name, prefix, limit=10, strained=None):
+        """distinct values of a filterable column starting with `prefix`, for typeahead
+
+        String columns are searched with a ``>= prefix AND < next prefix`` range
+        that an index on the column serves, other types by their text.  Results
+        are cached per column for :attr:`suggest_ttl` seconds, and a cached
+        result with fewer than `limit` values answers every longer prefix
+        without a query.  Comparison is binary, as Python compares strings.
+
+        :param session: SQLAlchemy session
+        :param name: filter style ``relative.column`` name
+        :param prefix: typed text
+        :param strained: StrainerFilter to only suggest values of matching rows
+        :return: sorted list of at most `limit` values
+        :raises KeyError: unknown, excluded or not filterable column
+        """
+        if not self._initialized:
+            self.init()
+        col = self.get(name)
+        if col is None or col in self._exclude or not col.filterable or col.column is None:
+            raise KeyError(name)
+        column = col.column
+        if strained is not None and strained.rejected:
+            return []
+        scope = None
+        if strained is not None and strained.filters:
+            scope = tuple((f['name'], f.get('action'), f.get('find'), bool(f.get('not')),
+                           repr(f.get('values'))) for f in strained.filters)
+        cache = self._suggestions.get(name)
+        if cache is None:
+            cache = self._suggestions.setdefault(name, _LRUCache(self.suggest_cache_size, self.suggest_ttl))
+
+        for n in range(len(prefix), -1, -1):
+            cached = cache.get((prefix[:n], limit, scope))
+            if cached is not None and (n == len(prefix) or len(cached) < limit):
+                return [v for v in cached if _text_of(v).startswith(prefix)][:limit]
+
+        if isinstance(column.type, sa.String):
+            criterion = column >= prefix
+            if prefix:
+                criterion = sql_and(criterion, column < prefix[:-1] + unichr(ord(prefix[-1]) + 1))
+        else:
+            escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            criterion = sa.cast(column, sa.String).like(escaped + '%', escape='\\')
+        query = session.query(column)
+        if scope is not None:
+            tbl, _ = self.split_name(name)
+            query = strained._strain(query.select_from(self._base.entity),
+                                     extra=(tbl,) if tbl != self.tablename else ())
+        query = query.filter(criterion, column.isnot(None))
+        query = query.distinct().order_by(column).limit(limit)
+        return cache.put((prefix, limit, scope), [v for v, in query])
+
     def exclude(self, *args):
         if args:
             exclude = args
             if len(exclude) == 1 and isinstance(exclude[0], (list, tuple)):
                 exclude = exclude[0]
             for field in exclude:
-                self._exclude.add(_dbmap[field])
+                self._exclude.add(self._dbmap[field])
+            self._loader = None
         return self._exclude
 
     @property
@@ -250,16 +1022,77 @@ class Strainer(object):
         return self._relatives
 
 
+"""shared strainers by mapped class"""
+_strainers = {}
+
+
+def strainer_for(model, **kwargs):
+    """process wide Strainer shared by every user of `model`
+
+    :param model: declarative class
+    :param kwargs: Strainer arguments, only used when the strainer is created
+    :rtype: Strainer
+    """
+    strainer = _strainers.get(model)
+    if strainer is None:
+        strainer = _strainers.setdefault(model, Strainer(model, **kwargs))
+    return strainer
+
+
+def warmup(*models):
+    """does all lazy setup of the shared strainers ahead of the first request
+
+    Builds the StrainerMap, initializes every shared strainer (resolving all
+    relatives) and resolves every filterable column and action of the base and
+    relatives.  Call it before a pre-fork server forks its workers so they share
+    the result copy-on-write (``gc.freeze()`` afterwards keeps it that way)::
+
+        strainer_for(Customer).relate('parent', 'parent')
+        warmup()
+
+    :param models: extra models to create shared strainers for
+    :return: the warmed strainers
+    """
+    from sqlstrainer import match
+    for model in models:
+        strainer_for(model)
+    strainers = list(_strainers.values())
+    for strainer in strainers:
+        if not strainer._initialized:
+            strainer.init()
+        if strainer._loader is None:
+            strainer._loader = strainer._new_loader()
+        resolve = getattr(strainer._loader, 'resolve', None)
+        if resolve is None:
+            continue
+        names = [strainer.tablename] + [r for r in strainer.relatives if not strainer.relatives[r].is_aggregate]
+        for name in names:
+            tbl = strainer.tablename if name == strainer.tablename else strainer.relatives[name].tablename
+            dbmap = strainer.dbmap
+            for column_name, col in dbmap.columns_of(dbmap.get_mapper(tbl)):
+                if not col.filterable:
+                    continue
+                for action in match.get_matchers(col.column) or ('contains',):
+                    resolve('{0}.{1}'.format(name, column_name), action)
+    return strainers
+
+
+class _SharedStrainer(object):
+    """descriptor returning the shared strainer of the class it is accessed on"""
+
+    def __get__(self, obj, cls):
+        return strainer_for(cls)
+
+
 class StrainerMixin(object):
-    """SQLStrainer Mixin - Adds a SQLStrainer instance to Declarative classes."""
+    """SQLStrainer Mixin - Adds the shared SQLStrainer instance to Declarative classes.
 
-    @property
-    def strainer(self):
-        strainer = getattr(self, '_strainer', None)
-        if strainer is None:
-            strainer = Strainer(self.__class__)
-            setattr(self, '_strainer', strainer)
-        return strainer
+    >>> Customer.strainer.relate('parent', 'parent')
+    >>> Customer.strainer is customer.strainer
+    True
+    """
+
+    strainer = _SharedStrainer()
 
 
 
@@ -60,12 +60,16 @@ From a VIEW:
 
 """
 import inspect
-from sqlalchemy.orm import ColumnProperty
+from collections import OrderedDict
+from sqlalchemy.orm import ColumnProperty, joinedload, load_only, selectinload
 from sqlalchemy.orm.attributes import InstrumentedAttribute
 from functools import wraps
 
 __author__ = 'Douglas MacDougall <douglas.macdougall@moesol.com>'
 
+VIEW_DISTINCT = 1
+VIEW_NESTED = 2
+
 _make_label = lambda s: s.replace('_', ' ').title()
 
 def find_viewable(cls, label=None, include=None, exclude=None):
@@ -123,3 +127,251 @@ def viewable(**info):
         return wrapper
     return decorator
 
+
+
+class StrainerView(object):
+    """Selects only the chosen viewable columns of a strainer base and its relatives
+
+    Rows are plain tuples of column values, mapped instances are never loaded.
+
+    * VIEW_DISTINCT: one row per base row, or per row of a viewed to-many
+      relative, rows with equal values are not merged
+    * VIEW_NESTED: one dict per base row, to-many relatives nested as lists of
+      dicts and to-one relatives as a dict (or None)
+
+    Both select the same rows: filters choose the base rows, and every related
+    row of a viewed relative (passing its flags) is shown, whether or not it
+    matched a filter on that relative.
+
+    >>> view = StrainerView(strainer, ['first_name', 'parent.first_name'])
+    >>> rows = view.all(session, strained)
+    """
+
+    def __init__(self, strainer, keys, view_type=VIEW_DISTINCT):
+        """
+        :param strainer: Strainer the view keys are resolved against
+        :param keys: list of ``relative.column`` view keys
+        :param view_type: VIEW_DISTINCT or VIEW_NESTED
+        :raises KeyError: unknown or excluded column
+        :raises ValueError: column cannot be selected in SQL
+        """
+        if view_type not in (VIEW_DISTINCT, VIEW_NESTED):
+            raise ValueError(view_type)
+        if not strainer._initialized:
+            strainer.init()
+        self._strainer = strainer
+        self._view_type = view_type
+        self._keys = list(keys)
+        self._columns = []
+        self._labels = []
+        excluded = strainer.exclude()
+        for key in self._keys:
+            tbl, _ = strainer.split_name(key)
+            col = strainer.get(key)
+            if col in excluded or not col.viewable:
+                raise KeyError(key)
+            if col.column is None:
+                raise ValueError('{0} is not selectable'.format(key))
+            label = col.label
+            if tbl != strainer.tablename:
+                label = '{0} {1}'.format(_make_label(tbl), label)
+            self._columns.append(col)
+            self._labels.append(label)
+
+    @staticmethod
+    def _expression(col):
+        # aggregates are always selected through their correlated subquery
+        scalar = getattr(col, 'scalar', None)
+        return col.column if scalar is None else scalar
+
+    @property
+    def keys(self):
+        return self._keys
+
+    @property
+    def labels(self):
+        return self._labels
+
+    @property
+    def types(self):
+        return [self._expression(col).type for col in self._columns]
+
+    @property
+    def relatives(self):
+        """names of the relatives the view selects from, in key order"""
+        names = []
+        for key in self._keys:
+            tbl, _ = self._strainer.split_name(key)
+            if tbl != self._strainer.tablename and tbl not in names:
+                names.append(tbl)
+        return names
+
+    def _collections(self):
+        """viewed to-many relatives, nested as lists"""
+        relatives = self._strainer.relatives
+        return [tbl for tbl in self.relatives if relatives[tbl].uselist and not relatives[tbl].is_aggregate]
+
+    def query(self, session, strained=None):
+        """builds the column query for the view
+
+        Relatives which are only viewed are outer joined, relatives which are also
+        filtered on are joined once by the filter.  Filters on to-many relatives
+        restrict the base rows with a semi-join on the base primary key instead,
+        so viewed to-many relatives are outer joined in full and no DISTINCT is
+        needed over the viewed columns.
+
+        :param session: SQLAlchemy session
+        :param strained: optional StrainerFilter from :meth:`Strainer.build`
+        :return: Query of column tuples
+        """
+        strainer = self._strainer
+        columns = [self._expression(col).label(key) for key, col in zip(self._keys, self._columns)]
+        pk = []
+        if self._view_type == VIEW_NESTED:
+            pk = list(strainer.base.primary_key)
+            # to-many rows are told apart by their primary key, not their values
+            for tbl in self._collections():
+                columns.extend(strainer.relatives[tbl]._mapper.primary_key)
+        query = session.query(*(pk + columns)).select_from(strainer.base)
+
+        semi_join = strained is not None and strained.joins_many
+        filtered = strained.tables if strained is not None and not semi_join else set()
+        joined = set()
+        for tbl in self.relatives:
+            relative = strainer.relatives[tbl]
+            if tbl in filtered or relative.is_aggregate:
+                continue
+            query = query.outerjoin(*relative.join)
+            if relative.flags:
+                query = query.filter(*relative.flags)
+            joined.add(tbl)
+
+        if semi_join:
+            query = strained.semi_join(query)
+        elif strained is not None:
+            query = strained.strain(query, joined=joined, distinct=False)
+        if self._view_type == VIEW_NESTED:
+            query = query.order_by(*pk)
+        return query
+
+    def options(self):
+        """loader options that eager load the viewed relatives of the base entities
+
+        Each relationship on a relative path is loaded once for all rows, with
+        ``selectinload`` for collections and ``joinedload`` for many-to-one, so the
+        number of queries depends on the relationships, not the rows.  Only the
+        viewed columns (and primary keys) are loaded, unless a hybrid property is
+        viewed which needs every column of its entity.
+
+        :return: list of loader options for :meth:`Query.options`
+        :raises ValueError: a relative path is not made of relationships
+        """
+        strainer = self._strainer
+        tree = OrderedDict([((), set())])
+        for key, col in zip(self._keys, self._columns):
+            tbl, _ = strainer.split_name(key)
+            path = ()
+            if tbl != strainer.tablename:
+                if strainer.relatives[tbl].is_aggregate:
+                    raise ValueError('{0} cannot be eager loaded'.format(key))
+                path = tuple(strainer.relatives[tbl].join)
+                for hop in path:
+                    if getattr(hop, 'property', None) is None:
+                        raise ValueError('{0} cannot be eager loaded'.format(key))
+                for i in range(1, len(path)):
+                    tree.setdefault(path[:i], set())
+            names = tree.setdefault(path, set())
+            if names is not None:
+                if isinstance(getattr(col.column, 'property', None), ColumnProperty):
+                    names.add(col.name)
+                else:
+                    tree[path] = None
+
+        options = []
+        for path, names in tree.items():
+            if not path:
+                if names:
+                    options.append(load_only(*names))
+                continue
+            loader = None
+            for hop in path:
+                strategy = selectinload if hop.property.uselist else joinedload
+                if loader is None:
+                    loader = strategy(hop)
+                else:
+                    loader = getattr(loader, strategy.__name__)(hop)
+            if names is not None:
+                if not names:
+                    names = [c.key for c in hop.property.mapper.primary_key]
+                loader = loader.load_only(*names)
+            options.append(loader)
+        return options
+
+    def load(self, session, strained=None):
+        """builds a query of base entities with the viewed relatives eager loaded
+
+        Relative flags restrict the base rows through the filter but are not applied
+        to the loaded collections.
+
+        :param session: SQLAlchemy session
+        :param strained: optional StrainerFilter from :meth:`Strainer.build`
+        :return: Query of base entities
+        """
+        query = session.query(self._strainer.base).options(*self.options())
+        if strained is not None:
+            query = strained.strain(query)
+        return query
+
+    def nest(self, rows):
+        """groups VIEW_NESTED rows into one dict per base row
+
+        To-many relatives become lists of dicts, one per related row (by primary
+        key) without repeats or empty (outer joined) entries.
+        """
+        strainer = self._strainer
+        width = len(strainer.base.primary_key)
+        fields = []
+        for i, key in enumerate(self._keys):
+            tbl, name = strainer.split_name(key)
+            fields.append((i + width, None if tbl == strainer.tablename else tbl, name))
+        # primary key columns of the to-many relatives follow the viewed columns
+        keys = {}
+        start = width + len(self._keys)
+        for tbl in self._collections():
+            end = start + len(strainer.relatives[tbl]._mapper.primary_key)
+            keys[tbl] = (start, end)
+            start = end
+        relatives = [(tbl, tbl in keys) for tbl in self.relatives]
+
+        nested = OrderedDict()
+        seen = set()
+        for row in rows:
+            ident = tuple(row[:width])
+            entry = nested.get(ident)
+            if entry is None:
+                entry = nested[ident] = OrderedDict(
+                    (name, row[i]) for i, tbl, name in fields if tbl is None)
+                for tbl, uselist in relatives:
+                    entry[tbl] = [] if uselist else None
+            for tbl, uselist in relatives:
+                if uselist:
+                    child_ident = tuple(row[slice(*keys[tbl])])
+                    if all(v is None for v in child_ident) or (ident, tbl, child_ident) in seen:
+                        continue
+                    seen.add((ident, tbl, child_ident))
+                child = OrderedDict((name, row[i]) for i, t, name in fields if t == tbl)
+                if uselist:
+                    entry[tbl].append(child)
+                elif not all(v is None for v in child.values()):
+                    entry[tbl] = child
+        return list(nested.values())
+
+    def all(self, session, strained=None):
+        """runs the view query
+
+        :return: list of rows for VIEW_DISTINCT, list of dicts for VIEW_NESTED
+        """
+        rows = self.query(session, strained).all()
+        if self._view_type == VIEW_NESTED:
+            return self.nest(rows)
+        return rows
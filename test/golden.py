@@ -0,0 +1,201 @@
+"""Golden SQL snapshots of strained queries
+
+Every filter spec of ``golden_corpus.json`` is built by a Customer strainer
+over the ``models.py`` schema and run on an empty in-memory SQLite database.
+The executed SQL and the ``EXPLAIN QUERY PLAN`` of each are kept in
+``golden.json``.  Comparing a run with the snapshot gives a unified diff per
+spec, flagged when it:
+
+* adds joins
+* adds DISTINCT
+* scans a table that was searched with an index
+* adds temp B-trees (sorting or DISTINCT without an index)
+
+Plans are only compared when the snapshot was taken with the same SQLite
+version, SQL only with the same SQLAlchemy version.
+
+    python test/golden.py            # review changes, exit status 1 if any
+    python test/golden.py --update   # accept them
+"""
+import argparse
+import difflib
+import json
+import os
+import re
+import sqlite3
+import sys
+
+import sqlalchemy as sa
+from sqlalchemy.orm import configure_mappers, create_session
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [_here, os.path.join(_here, '..')]
+import models as m
+from sqlstrainer.diagnostics import SlowFilterLog
+from sqlstrainer.strainer import Strainer
+
+__author__ = 'Douglas MacDougall <douglas.macdougall@moesol.com>'
+
+CORPUS = os.path.join(_here, 'golden_corpus.json')
+SNAPSHOT = os.path.join(_here, 'golden.json')
+
+_SCAN = re.compile(r'\b(SCAN|SEARCH) (?:TABLE )?(\w+)')
+
+
+def versions():
+    """major.minor of the libraries the SQL and plans depend on"""
+    return {
+        'sqlalchemy': '.'.join(sa.__version__.split('.')[:2]),
+        'sqlite': '.'.join(sqlite3.sqlite_version.split('.')[:2]),
+    }
+
+
+def make_strainer(spec):
+    """Customer strainer with every relative the corpus uses"""
+    strainer = Strainer(m.Customer, strict=True)
+    if 'anti_join' in spec:
+        strainer.anti_join = spec['anti_join']
+    if 'restrictive' in spec:
+        strainer.restrictive = spec['restrictive']
+    strainer.relate('parent', m.Customer.parent)
+    strainer.relate('orders', m.Customer.orders)
+    strainer.relate('products', 'orders.product_quantity.product')
+    strainer.relate('order_stats', 'orders', aggregate={'count': 'count'})
+    strainer.relate('order_totals', 'orders', strategy='having',
+                    aggregate={'total': ('sum', 'derived_order_value')})
+    return strainer
+
+
+def _plan_lines(rows):
+    """EXPLAIN QUERY PLAN rows as an indented tree, TABLE dropped as newer SQLite does"""
+    depth = {0: -1}
+    lines = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        detail = re.sub(r'\b(SCAN|SEARCH) TABLE ', r'\1 ', detail)
+        lines.append('  ' * depth[node] + detail)
+    return lines
+
+
+def record(corpus=None):
+    """{spec id: {'sql': lines, 'plan': lines}} of the current tree"""
+    if corpus is None:
+        with open(CORPUS) as f:
+            corpus = json.load(f)
+    configure_mappers()
+    engine = sa.create_engine('sqlite://')
+    m.Model.metadata.create_all(engine)
+    session = create_session(bind=engine)
+    plans = {}
+    for spec in corpus:
+        strainer = make_strainer(spec)
+        strainer.diagnostics = log = SlowFilterLog(threshold=-1)
+        log.attach(engine)
+        strained, _ = strainer.build(spec['filters'])
+        strained.strain(session.query(m.Customer)).all()
+        entry = log.entries()[0]
+        plans[spec['id']] = {
+            'sql': entry.sql.splitlines(),
+            'plan': _plan_lines(entry.plan),
+        }
+    engine.dispose()
+    return plans
+
+
+def _tables(plan, kind):
+    return set(t for k, t in (_SCAN.search(line).groups() for line in plan if _SCAN.search(line)) if k == kind)
+
+
+def flags(old, new):
+    """regressions between two recordings of one spec"""
+    found = []
+    old_sql, new_sql = ' '.join(old['sql']), ' '.join(new['sql'])
+    joins = old_sql.count(' JOIN '), new_sql.count(' JOIN ')
+    if joins[1] > joins[0]:
+        found.append('joins added: {0} -> {1}'.format(*joins))
+    if 'DISTINCT' in new_sql and 'DISTINCT' not in old_sql:
+        found.append('DISTINCT added')
+    if 'plan' in old and 'plan' in new:
+        scanned = (_tables(old['plan'], 'SEARCH') - _tables(old['plan'], 'SCAN')) & _tables(new['plan'], 'SCAN')
+        for table in sorted(scanned):
+            found.append('scan replaced index search: {0}'.format(table))
+        btrees = [sum('TEMP B-TREE' in line for line in p['plan']) for p in (old, new)]
+        if btrees[1] > btrees[0]:
+            found.append('temp b-trees added: {0} -> {1}'.format(*btrees))
+    return found
+
+
+def _text(recorded):
+    lines = list(recorded['sql'])
+    if 'plan' in recorded:
+        lines.append('-- plan')
+        lines.extend(recorded['plan'])
+    return [line + '\n' for line in lines]
+
+
+def review(snapshot, current):
+    """[(spec id, flags, unified diff)] of every spec that changed"""
+    compare_plans = snapshot.get('versions', {}).get('sqlite') == current['versions']['sqlite']
+    changes = []
+    old_plans, new_plans = snapshot.get('plans', {}), current['plans']
+    for name in sorted(set(old_plans) | set(new_plans)):
+        old, new = old_plans.get(name), new_plans.get(name)
+        if old is None or new is None:
+            changes.append((name, ['added' if old is None else 'removed'], ''))
+            continue
+        if not compare_plans:
+            old, new = {'sql': old['sql']}, {'sql': new['sql']}
+        if old == new:
+            continue
+        diff = ''.join(difflib.unified_diff(_text(old), _text(new), 'golden/' + name, 'current/' + name))
+        changes.append((name, flags(old, new), diff))
+    return changes
+
+
+def report(changes):
+    out = []
+    for name, found, diff in changes:
+        out.append('{0}: {1}'.format(name, ', '.join(found) or 'changed'))
+        if diff:
+            out.append(diff)
+    return '\n'.join(out)
+
+
+def load(path=SNAPSHOT):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(current, path=SNAPSHOT):
+    with open(path, 'w') as out:
+        json.dump(current, out, indent=1, sort_keys=True)
+        out.write('\n')
+
+
+def snapshot():
+    """current recording with the versions it depends on"""
+    return {'versions': versions(), 'plans': record()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--update', action='store_true', help='write the current plans to the snapshot')
+    args = parser.parse_args()
+
+    current = snapshot()
+    if args.update or not os.path.exists(SNAPSHOT):
+        save(current)
+        return
+    golden = load()
+    if golden['versions']['sqlalchemy'] != current['versions']['sqlalchemy']:
+        sys.stderr.write('snapshot taken with SQLAlchemy {0}, rerun with --update to compare\n'.format(
+            golden['versions']['sqlalchemy']))
+        sys.exit(2)
+    changes = review(golden, current)
+    if changes:
+        print(report(changes))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
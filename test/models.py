@@ -6,6 +6,7 @@ http://www.databaseanswers.org/data_models/customers_inventory_and_pos/index.htm
 import random
 import re
 from faker import Factory
+from sqlstrainer._compat import iteritems
 from marshmallow import fields
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy import Column, Integer, String, ForeignKey, Date, DECIMAL, func, DateTime
@@ -155,8 +156,7 @@ class OrderProduct(Model):
     product = orm.relationship(Product, backref='order_quantity', info={'label': 'PRODUCT'})
 
 
-Order.products = association_proxy('product_quantity', 'product')
-Order.products.info = {'label': 'Product Stuffs'}
+Order.products = association_proxy('product_quantity', 'product', info={'label': 'Product Stuffs'})
 Product.orders = association_proxy('order_quantity', 'order')
 
 
@@ -177,7 +177,7 @@ def build_fake_data(session):
         ('m', 'Meter'),
         ('ea', 'Each')
     ))
-    for uom_code, description in codes.iteritems():
+    for uom_code, description in iteritems(codes):
         uom = UnitOfMeasure(uom_code=uom_code, description=description)
         session.add(uom)
     session.flush()
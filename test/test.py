@@ -1,3 +1,4 @@
+from sqlalchemy import orm
 from sqlalchemy.orm import create_session
 import pytest
 
@@ -8,7 +9,7 @@ from sqlalchemy import create_engine
 session = None
 import models as m
 
-def setup():
+def setup_module():
     global session
     engine = create_engine('sqlite:///:memory:')
     session = create_session(bind=engine)
@@ -26,7 +27,7 @@ def strainer():
 
 
 
-def teardown():
+def teardown_module():
     pass
 #    m.dump(session)
 
@@ -35,10 +36,10 @@ def test_something(strainer):
     from sqlstrainer.mapper import StrainerMap
     sm = StrainerMap()
     rs = sm.relations_of(sm.to_mapper(m.Customer))
-    mm = sm.to_mapper(rs.keys()[0])
+    mm = sm.to_mapper(list(rs.keys())[0])
     args = [ { 'name': 'first_name', 'values': ['b', 'c', 'd'] }
              ]
-    st = strainer.build(args)
+    st, errors = strainer.build(args)
     q = session.query(m.Customer)
     c1 = q.count()
     q = st.strain(q)
@@ -51,7 +52,7 @@ def test_something(strainer):
              { 'name': 'parent.first_name', 'values': ['b', 'c', 'd'] }
              ]
 #    strainer.relate('parent', 'parent')
-    st = strainer.build(args)
+    st, errors = strainer.build(args)
     c3 = st.strain(q).count()
 
     assert(c2 > c3)
@@ -64,3 +65,818 @@ def test_something(strainer):
 #
 # def test_something3(strainer):
 #     assert(len(strainer.columns) > 0)
+
+
+def test_export_csv(strainer):
+    import csv
+    import io
+    from sqlstrainer.export import export, export_query, CSVWriter
+
+    st, errors = strainer.build([{'name': 'first_name', 'values': ['a']}])
+    out = io.StringIO()
+    count = export(session, st, ['first_name', 'parent.first_name'], CSVWriter(out), batch_size=7)
+    rows = list(csv.reader(io.StringIO(out.getvalue())))
+
+    assert(rows[0] == ['First Name', 'Parent First Name'])
+    assert(count == len(rows) - 1 == st.strain(session.query(m.Customer)).count() > 0)
+    assert('DISTINCT' not in str(export_query(session, st, ['first_name', 'parent.first_name'])[2]))
+    assert(all('a' in r[0].lower() for r in rows[1:]))
+
+
+def test_export_jsonl(strainer):
+    import io
+    import json
+    from sqlstrainer.export import export, JSONLinesWriter
+
+    st, errors = strainer.build([{'name': 'parent.first_name', 'values': ['e']}])
+    out = io.StringIO()
+    count = export(session, st, ['customer_id', 'dob'], JSONLinesWriter(out))
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+
+    assert(count == len(rows) > 0)
+    assert(set(rows[0]) == {'Customer Id', 'Dob'})
+
+
+def test_export_arrow(strainer):
+    import io
+    pa = pytest.importorskip('pyarrow')
+    from sqlstrainer.export import export, ArrowWriter
+
+    st, errors = strainer.build([])
+    out = io.BytesIO()
+    count = export(session, st, ['customer_id', 'dob', 'parent.last_name'], ArrowWriter(out), batch_size=10)
+    table = pa.ipc.open_stream(out.getvalue()).read_all()
+
+    assert(table.num_rows == count == session.query(m.Customer).count())
+    assert(table.schema.names == ['Customer Id', 'Dob', 'Parent Last Name'])
+
+
+def test_view_distinct(strainer):
+    st, errors = strainer.build([{'name': 'first_name', 'values': ['a']}])
+    view = strainer.view(['first_name', 'parent.first_name'])
+    rows = view.all(session, st)
+
+    assert(view.labels == ['First Name', 'Parent First Name'])
+    assert(len(rows) == st.strain(session.query(m.Customer)).count() > 0)
+    assert(all(not isinstance(r, m.Model) and len(r) == 2 for r in rows))
+
+    strainer.relate('orders', 'orders')
+    st, errors = strainer.build([{'name': 'orders.details', 'values': ['a']}])
+    rows = strainer.view(['gender']).all(session, st)
+    query = strainer.view(['gender']).query(session, st)
+    assert('DISTINCT' not in str(query).split('IN (')[0])
+    assert(len(rows) == st.strain(session.query(m.Customer)).count() > len(set(rows)))
+
+
+def test_view_nested(strainer):
+    strainer.relate('orders', 'orders')
+    st, errors = strainer.build([{'name': 'orders.derived_order_value', 'values': ['500'], 'action': 'gt'}])
+    view = strainer.view(['first_name', 'parent.last_name', 'orders.order_id'], strainer.VIEW_NESTED)
+    customers = view.all(session, st)
+
+    assert(len(customers) > 0)
+    assert(set(customers[0]) == {'first_name', 'parent', 'orders'})
+    assert(set(customers[0]['parent']) == {'last_name'})
+    ids = [o['order_id'] for c in customers for o in c['orders']]
+    matching = st.strain(session.query(m.Customer.customer_id)).subquery()
+    assert(len(ids) == len(set(ids)) == session.query(m.Order).filter(m.Order.customer_id.in_(matching)).count())
+
+    # filters choose customers, every order of theirs is shown by both view types
+    st, errors = strainer.build([{'name': 'orders.details', 'values': ['a']}])
+    matching = st.strain(session.query(m.Customer.customer_id)).subquery()
+    expected = session.query(m.Order).filter(m.Order.customer_id.in_(matching)).count()
+    nested = strainer.view(['customer_id', 'orders.order_id'], strainer.VIEW_NESTED).all(session, st)
+    rows = strainer.view(['customer_id', 'orders.order_id']).all(session, st)
+    assert(sum(len(c['orders']) for c in nested) == len(rows) == expected)
+    assert(expected > session.query(m.Order).filter(m.Order.details.contains('a')).count())
+
+    # orders with equal viewed values are still separate rows
+    customers = strainer.view(['customer_id', 'orders.customer_id'], strainer.VIEW_NESTED).all(session)
+    assert(sum(len(c['orders']) for c in customers) == session.query(m.Order).count())
+
+
+def test_view_eager_load(strainer):
+    from sqlalchemy import event
+
+    strainer.relate('orders', 'orders')
+    st, errors = strainer.build([{'name': 'first_name', 'values': ['a']}])
+    view = strainer.view(['first_name', 'parent.first_name', 'orders.order_id'], strainer.VIEW_NESTED)
+    session.expunge_all()
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(session.bind, 'before_cursor_execute', listener)
+    try:
+        customers = view.load(session, st).all()
+        orders = [o.order_id for c in customers for o in c.orders]
+        parents = [c.parent.first_name for c in customers]
+    finally:
+        event.remove(session.bind, 'before_cursor_execute', listener)
+
+    assert(len(customers) > 1 and orders and parents)
+    # base + parent joined, orders selected in
+    assert(len(statements) == 2)
+    assert('last_name' not in statements[0] and 'details' not in statements[1])
+
+
+@pytest.mark.parametrize('strategy', ['subquery', 'having'])
+def test_aggregate_relative(strainer, strategy):
+    from sqlalchemy import func
+
+    strainer.relate('order_stats', 'orders', strategy=strategy,
+                    aggregate={'count': 'count', 'total': ('sum', 'derived_order_value')})
+    st, errors = strainer.build([{'name': 'order_stats.count', 'action': 'gt', 'values': ['10']}])
+    expected = session.query(m.Order.customer_id).group_by(m.Order.customer_id)\
+        .having(func.count(m.Order.order_id) > 10).count()
+
+    assert(st.strain(session.query(m.Customer)).count() == expected)
+    assert('GROUP BY' in str(st.strain(session.query(m.Customer))) or strategy == 'subquery')
+
+    rows = strainer.view(['customer_id', 'order_stats.count', 'order_stats.total']).all(session, st)
+    assert(len(rows) == expected)
+    assert(all(r[1] > 10 for r in rows))
+
+
+def test_compiled_schema_matches_marshmallow():
+    from sqlstrainer.schema import StrainerSchema
+
+    data = [{'name': 'first_name', 'values': ['b', 'c'], 'find': 'all'},
+            {'name': 'customer_id', 'values': [46], 'action': 'gt'},
+            {'name': 'parent.first_name', 'values': ['b'], 'not_': True},
+            {'name': 'dob', 'action': 'empty'}]
+    built = []
+    for schema in (StrainerSchema, None):
+        kwargs = {'schema': schema} if schema else {}
+        strainer = Strainer(m.Customer, **kwargs)
+        strainer.relate('parent', [m.Customer.parent])
+        st, errors = strainer.build(data)
+        assert(not errors)
+        built.append([(f['name'], f.get('values'), str(f['filter'])) for f in st._filters])
+        _, errors = strainer.build([{'name': 'nope', 'values': ['x']}, {'values': ['x']}])
+        assert(set(errors) == {'_schema', 'name'} and len(errors['_schema']) == 2)
+
+    assert(built[0] == built[1])
+
+
+@pytest.mark.parametrize('processes', [None, 2])
+def test_build_many(strainer, processes):
+    datasets = [[{'name': 'first_name', 'values': [c]}, {'name': 'parent.first_name', 'values': ['a']}]
+                for c in 'abcdefg']
+    datasets.append([{'name': 'nope', 'values': ['x']}])
+    built = strainer.build_many(datasets, processes=processes, chunksize=3)
+
+    assert(len(built) == len(datasets))
+    assert([bool(errors) for _, errors in built] == [False] * 7 + [True])
+    q = session.query(m.Customer)
+    for data, (st, _) in zip(datasets[:-1], built):
+        assert(st.strain(q).count() == strainer.build(data)[0].strain(q).count())
+
+
+def test_shared_strainer_warmup():
+    from sqlstrainer import strainer as strainer_module
+    from sqlstrainer.strainer import StrainerMixin, strainer_for, warmup
+
+    class Shared(StrainerMixin):
+        pass
+
+    shared = strainer_for(m.Order)
+    shared.relate('customer', 'customer')
+    try:
+        assert(Shared.strainer is Shared().strainer is strainer_for(Shared))
+        assert(strainer_for(m.Order) is shared and not shared._initialized)
+        strainer_module._strainers.pop(Shared)
+
+        warmed = warmup(m.Product)
+        assert(shared in warmed and strainer_for(m.Product) in warmed)
+        assert(shared._initialized and 'customer' in shared.relatives)
+        assert(('customer.first_name', 'contains') in shared._loader._resolved)
+        assert(shared.build([{'name': 'customer.first_name', 'values': ['a']}])[0].strain(
+            session.query(m.Order)).count() > 0)
+    finally:
+        strainer_module._strainers.clear()
+
+
+def test_concurrent_first_build():
+    import threading
+    import time
+
+    strainer = Strainer(m.Customer)
+    strainer.relate('parent', 'parent')
+    relate = strainer._relate
+
+    def slow_relate(*args):
+        time.sleep(0.05)
+        relate(*args)
+
+    strainer._relate = slow_relate
+    results = []
+
+    def build():
+        results.append(strainer.build([{'name': 'parent.first_name', 'values': ['a']}])[1])
+
+    threads = [threading.Thread(target=build) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert(results == [{}] * 4)
+
+
+def test_default_map_builds_once():
+    import threading
+    from sqlstrainer import strainer as strainer_module
+
+    saved = strainer_module._dbmap
+    strainer_module._dbmap = None
+    built = []
+    barrier = threading.Barrier(8)
+
+    def first_request():
+        barrier.wait()
+        built.append(strainer_module.default_map())
+    try:
+        threads = [threading.Thread(target=first_request) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert(len(built) == 8 and all(b is built[0] for b in built))
+    finally:
+        strainer_module._dbmap = saved
+
+
+def test_separate_declarative_bases():
+    from sqlalchemy import Column, Integer, String, ForeignKey
+    from sqlalchemy.ext.declarative import declarative_base
+    from sqlstrainer.mapper import StrainerMap
+
+    Tenant = declarative_base()
+
+    class Account(Tenant):
+        __tablename__ = 'tenant_account'
+        account_id = Column(Integer, primary_key=True)
+        name = Column(String)
+
+    class Member(Tenant):
+        __tablename__ = 'tenant_member'
+        member_id = Column(Integer, primary_key=True)
+        account_id = Column(Integer, ForeignKey(Account.account_id))
+        email = Column(String)
+        account = orm.relationship(Account, backref='members')
+
+    dbmap = StrainerMap.for_base(Tenant)
+    assert(dbmap.get('tenant_member.email') is not None)
+    assert(dbmap.get('customer') is None)
+
+    strainer = Strainer(Member, dbmap=dbmap)
+    strainer.relate('account', 'account')
+    st, errors = strainer.build([{'name': 'account.name', 'values': ['acme']}])
+    assert(not errors and strainer.dbmap is dbmap)
+    assert('tenant_account.name' in str(st.strain(create_session().query(Member))))
+
+
+def test_strainer_column_expression_cache():
+    from sqlstrainer.mapper import _StrainerColumn
+
+    mapper = orm.class_mapper(m.Customer)
+    cached = _StrainerColumn(mapper, 'test', m.Customer.__dict__['test'], label='Test')
+    dynamic = _StrainerColumn(mapper, 'test', m.Customer.__dict__['test'], cache_expression=False)
+    column = _StrainerColumn(mapper, 'first_name', m.Customer.first_name)
+    prop = _StrainerColumn(mapper, 'view_only', m.Customer.__dict__['view_only'])
+
+    assert(not hasattr(cached, '__dict__'))
+    assert(cached.column is cached.column)
+    assert(dynamic.column is not dynamic.column)
+    assert(str(dynamic.column) == str(cached.column))
+    assert(column.column is m.Customer.first_name)
+    assert(prop.column is None and not prop.filterable)
+
+
+def test_dynamic_expression_not_cached():
+    from sqlalchemy import Column, Integer
+    from sqlalchemy.ext.declarative import declarative_base
+    from sqlstrainer.mapper import StrainerMap
+    from sqlstrainer.strainer import strainer_property
+
+    Dyn = declarative_base()
+    state = {'column': 'a'}
+
+    class DynT(Dyn):
+        __tablename__ = 'dyn_t'
+        dyn_id = Column(Integer, primary_key=True)
+        a = Column(Integer)
+        b = Column(Integer)
+
+        @strainer_property(cache_expression=False)
+        def pick(self):
+            return getattr(self, state['column'])
+
+    strainer = Strainer(DynT, dbmap=StrainerMap.for_base(Dyn))
+    query = create_session().query(DynT)
+    st, errors = strainer.build([{'name': 'pick', 'action': 'eq', 'values': [1]}])
+    assert('dyn_t.a =' in str(st.strain(query)))
+    state['column'] = 'b'
+    st, errors = strainer.build([{'name': 'pick', 'action': 'eq', 'values': [1]}])
+    assert('dyn_t.b =' in str(st.strain(query)))
+
+    st, errors = strainer.build([{'name': 'made_up_{0}'.format(i), 'values': ['x']} for i in range(50)] +
+                                [{'name': 'a', 'action': 'eq', 'values': [1]}])
+    assert(len(errors['_schema']) == 50 and list(strainer._loader._resolved) == [('a', 'eq')])
+
+
+def test_join_path_cache():
+    from sqlstrainer.mapper import StrainerMap
+
+    sm = StrainerMap(cache_size=2)
+    path = [m.Customer, m.Customer.orders, m.Order.product_quantity]
+    first = sm.join_path(path)
+    assert(len(path) == 3)
+    first.append('mutated')
+    assert(sm.join_path(list(path)) == [m.Customer.orders, m.Order.product_quantity])
+    assert(len(sm._paths) == 1)
+
+    dotted = sm.join_from_dotted('customer.orders.product_quantity')
+    assert(dotted == sm.join_from_dotted(' customer . orders.product_quantity'))
+    assert(dotted == first[:2])
+    sm.join_from_dotted('customer.parent')
+    assert(len(sm._paths) == 2)
+
+    sm.refresh()
+    assert(len(sm._paths) == 0)
+
+
+def test_instrument_phases(strainer):
+    from sqlstrainer import instrument
+
+    events = []
+    instrument.listen(events.append)
+    instrument.instrument_engine(session.bind)
+    try:
+        args = [{'name': 'first_name', 'values': ['b', 'c']},
+                {'name': 'parent.first_name', 'values': ['b']}]
+        st, errors = strainer.build(args)
+        st.strain(session.query(m.Customer)).all()
+    finally:
+        instrument.remove(events.append)
+    phases = dict((e.phase, e) for e in events)
+    assert(set(phases) == set(['build', 'validate', 'compile', 'strain', 'sql', 'execute']))
+    assert(all(e.mapper is strainer.base and e.fingerprint == st.fingerprint for e in events))
+    assert(phases['build'].counters == dict(filters=2, errors=0, values=3, max_values=2))
+    assert(phases['validate'].counters == dict(entries=2))
+    assert(phases['strain'].counters == dict(filters=2, joins=1, distinct=1))
+    assert(phases['execute'].counters['sql_length'] > 0)
+
+    other, errors = strainer.build([{'name': 'first_name', 'values': ['x', 'y']},
+                                    {'name': 'parent.first_name', 'values': ['z']}])
+    assert(other.fingerprint == st.fingerprint)
+    del events[:]
+    strainer.build(args)
+    assert(not events)
+
+
+def test_index_advisor():
+    from sqlalchemy.dialects import postgresql
+    from sqlstrainer.advisor import IndexAdvisor
+
+    strainer = Strainer(m.Customer)
+    strainer.relate('orders', m.Customer.orders)
+    strainer.relate('parent', m.Customer.parent)
+    advisor = IndexAdvisor()
+    for _ in range(3):
+        st, errors = strainer.build([{'name': 'orders.details', 'values': ['x']},
+                                     {'name': 'parent.parent_id', 'action': 'eq', 'values': ['1']}])
+        advisor.record(st)
+    st, errors = strainer.build([{'name': 'last_name', 'action': 'is', 'values': ['a']}])
+    advisor.record(st)
+
+    usage = advisor.usage()
+    assert(usage[('order', 'customer_id')] == {'join': 3})
+    assert(usage[('parent', 'parent_id')] == {'join': 3, 'eq': 3})
+
+    report = dict(((r.table, r.column, r.kind), r) for r in advisor.report())
+    # primary keys are indexed
+    assert(not [k for k in report if k[:2] == ('parent', 'parent_id')])
+    assert(report[('order', 'customer_id', 'btree')].uses == 3)
+    assert(report[('order', 'details', 'lower')].ddl == 'CREATE INDEX ix_order_lower_details ON "order" (lower(details))')
+    assert(report[('customer', 'last_name', 'btree')].uses == 1)
+    assert([r.uses for r in advisor.report()] == [3, 3, 1])
+
+    pg = advisor.report(dialect=postgresql.dialect())
+    assert('gin_trgm_ops' in [r for r in pg if r.kind == 'trigram'][0].ddl)
+    assert(len(advisor.report(bind=session.bind)) == 3)
+
+
+def test_cost_budget():
+    from sqlstrainer.cost import CostModel
+    from sqlstrainer.strainer import StrainerError
+
+    cost = CostModel(budget=10)
+    strainer = Strainer(m.Customer, cost=cost)
+    strainer.relate('orders', m.Customer.orders)
+    cheap = [{'name': 'customer_id', 'action': 'gt', 'values': ['5']}]
+    st, errors = strainer.build(cheap)
+    assert(not errors and len(st.filters) == 1)
+    # filter, value, unindexable contains, join and to-many hop
+    assert(cost.score(strainer, [{'name': 'orders.details', 'values': ['a', 'b']}]) == 1 + 0.4 + 3 + 2 + 4)
+
+    greedy = cheap + [{'name': 'orders.details', 'values': ['x'] * 20}, {'name': 'first_name', 'values': ['a']}]
+    st, errors = strainer.build(greedy)
+    assert(not st.filters and st.rejected)
+    assert(errors['_cost'] == ['filter cost 19.4 exceeds budget 10'])
+    # a rejected request matches nothing, even when the errors are ignored
+    assert(st.strain(session.query(m.Customer)).count() == 0)
+    assert(strainer.suggest(session, 'first_name', 'a', strained=st) == [])
+    batch = strainer.build_many([cheap, greedy])
+    assert(batch[1][1] == errors and batch[1][0].rejected and not batch[0][0].rejected)
+
+    cost.degrade = True
+    st, errors = strainer.build(greedy)
+    assert([f['name'] for f in st.filters] == ['customer_id', 'first_name'] and not st.rejected)
+    assert(len(errors['_cost']) == 2)
+
+    strict = Strainer(m.Customer, strict=True, cost=CostModel(budget=1))
+    with pytest.raises(StrainerError) as e:
+        strict.build(greedy)
+    assert('_cost' in e.value.errors)
+    # strict mode only raises, valid data still builds (filter, errors)
+    st, errors = Strainer(m.Customer, strict=True).build(cheap)
+    assert(not errors and len(st.filters) == 1)
+
+
+def test_strain_select():
+    from sqlalchemy import select
+
+    strainer = Strainer(m.Customer)
+    strainer.relate('parent', m.Customer.parent)
+    strainer.relate('orders', m.Customer.orders)
+    st, errors = strainer.build([{'name': 'first_name', 'values': ['a']},
+                                 {'name': 'parent.last_name', 'values': ['e']},
+                                 {'name': 'orders.derived_order_value', 'action': 'ge', 'values': ['0']}])
+    expected = sorted(c.customer_id for c in st.strain(session.query(m.Customer)))
+    stmt = st.strain(select([m.Customer.__table__.c.customer_id]))
+    assert(str(stmt).count('JOIN') == 2)
+    assert(sorted(r[0] for r in session.execute(stmt)) == expected)
+
+
+
+def test_concurrent_page(tmpdir):
+    from sqlalchemy.orm import Session
+
+    engine = create_engine('sqlite:///' + str(tmpdir.join('page.db')))
+    m.Model.metadata.create_all(engine)
+    s = create_session(bind=engine)
+    m.build_fake_data(s)
+    strainer = Strainer(m.Customer)
+    strainer.relate('parent', m.Customer.parent)
+    st, errors = strainer.build([{'name': 'first_name', 'values': ['a']}])
+
+    query = Session(bind=engine).query(m.Customer)
+    page = st.page(query, engine, limit=5, offset=1, facets=['gender', 'parent.last_name'])
+    total = st.strain(query).count()
+    assert(page.total == total)
+    assert(len(page.items) == min(5, total - 1))
+    assert(sum(n for _, n in page.facets['gender']) == total)
+    assert(sum(n for _, n in page.facets['parent.last_name']) == total)
+    assert(list(page.facets) == ['gender', 'parent.last_name'])
+
+
+def test_shard_fan_out(tmpdir):
+    from sqlalchemy import desc
+    from sqlalchemy.orm import Session
+    from sqlstrainer.shard import FanOut
+
+    engines = []
+    for i in range(3):
+        engine = create_engine('sqlite:///' + str(tmpdir.join('shard{0}.db'.format(i))))
+        m.Model.metadata.create_all(engine)
+        m.build_fake_data(create_session(bind=engine))
+        engines.append(engine)
+    strainer = Strainer(m.Customer)
+    strainer.relate('parent', m.Customer.parent)
+    st, errors = strainer.build([{'name': 'parent.first_name', 'values': ['a', 'e']}])
+    query = Session().query(m.Customer)
+    rows = []
+    for engine in engines:
+        rows.extend((c.last_name, -c.customer_id) for c in st.strain(query.with_session(Session(bind=engine))))
+    rows.sort()
+
+    shards = FanOut(engines)
+    order = [m.Customer.last_name, desc(m.Customer.customer_id)]
+    merged = [(c.last_name, -c.customer_id) for c in shards.iter(st, query, order_by=order, batch_size=7)]
+    assert(merged == rows)
+    page = shards.all(st, query, order_by=order, limit=10, offset=5)
+    assert([(c.last_name, -c.customer_id) for c in page] == rows[5:15])
+    assert(len(shards.all(st, query)) == len(rows))
+    assert(shards.count(st, query) == len(rows))
+    assert(sum(n for _, n in shards.facet(st, query, 'gender')) == len(rows))
+
+    from sqlalchemy.dialects import postgresql
+    from sqlstrainer.shard import _shard_order
+    pg = str(query.order_by(*_shard_order(order, 'postgresql')).statement.compile(dialect=postgresql.dialect()))
+    assert('ORDER BY customer.last_name ASC NULLS FIRST, customer.customer_id DESC NULLS LAST' in pg)
+    assert(_shard_order(order, 'sqlite') == order)
+
+    # merge keys are base entity attributes, whatever their column is named
+    from sqlalchemy import Column, Integer, String
+    from sqlalchemy.ext.declarative import declarative_base
+    from sqlstrainer.shard import _sort_columns
+
+    class Renamed(declarative_base()):
+        __tablename__ = 'renamed'
+        id = Column(Integer, primary_key=True)
+        label = Column('name', String)
+
+    assert(_sort_columns([desc(Renamed.label), Renamed.id], Renamed.__mapper__) == [('label', True), ('id', False)])
+    with pytest.raises(ValueError):
+        shards.all(st, query, order_by=[desc(m.Parent.first_name)])
+
+
+def test_import_time_budget():
+    import os
+    import subprocess
+    import sys
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bench', 'importtime.py')
+    assert(subprocess.call([sys.executable, script, '--check', '--repeat', '3'], stdout=subprocess.PIPE) == 0)
+
+
+def test_strained_ids():
+    from sqlalchemy import func, select
+
+    strainer = Strainer(m.Customer)
+    strainer.relate('parent', m.Customer.parent)
+    st, errors = strainer.build([{'name': 'parent.first_name', 'values': ['a', 'e']},
+                                 {'name': 'current_balance', 'action': 'gt', 'values': ['100']}])
+    expected = sorted(c.customer_id for c in st.strain(session.query(m.Customer)))
+
+    ids = st.ids(cte=True)
+    assert(str(ids.select()).startswith('WITH customer_ids AS'))
+    by_parent = st.join_ids(session.query(m.Customer.parent_id, func.count(m.Customer.customer_id)), ids)
+    by_parent = by_parent.group_by(m.Customer.parent_id)
+    assert(sum(n for _, n in by_parent) == len(expected))
+    listed = st.join_ids(session.query(m.Customer.customer_id), ids)
+    assert(sorted(i for i, in listed) == expected)
+
+    core = st.join_ids(select([m.Customer.__table__.c.customer_id]))
+    assert(sorted(r[0] for r in session.execute(core)) == expected)
+    assert(str(core).count('JOIN') == 2)
+
+
+def test_order_by_relatives():
+    strainer = Strainer(m.Customer)
+    strainer.relate('parent', m.Customer.parent)
+    strainer.relate('orders', m.Customer.orders)
+    st, errors = strainer.build([{'name': 'orders.derived_order_value', 'action': 'gt', 'values': ['10']}])
+    customers = st.strain(session.query(m.Customer)).all()
+
+    q = st.order_by(session.query(m.Customer), ['parent.first_name', '-customer_id'], limit=10)
+    sql = str(q)
+    assert(sql.count('LEFT OUTER JOIN parent') == 1 and sql.count('JOIN "order"') == 1)
+    expected = sorted(customers, key=lambda c: (c.parent.first_name, -c.customer_id))[:10]
+    assert(q.all() == expected)
+
+    q = st.order_by(session.query(m.Customer), ['-orders.derived_order_value'], limit=5, offset=2)
+    top = sorted(customers, key=lambda c: (-max(o.derived_order_value for o in c.orders), c.customer_id))
+    assert(q.all() == top[2:7])
+    assert(str(q).count('FROM customer JOIN "order"') == 1)
+    assert(not str(q).startswith('SELECT DISTINCT'))
+
+    st, errors = strainer.build([{'name': 'parent.first_name', 'values': ['a']}])
+    q = st.order_by(session.query(m.Customer), ['customer_id'], limit=5)
+    assert('DISTINCT' not in str(q) and str(q).count('customer.customer_id\n') == 1)
+    assert('ORDER BY customer.customer_id\n' in str(q))
+
+    # strain() stays DISTINCT for column queries, distinct=False opts out
+    genders = st.strain(session.query(m.Customer.gender)).all()
+    assert(len(genders) == len(set(genders)))
+    assert('DISTINCT' not in str(st.strain(session.query(m.Customer), distinct=False)))
+
+
+def test_suggest_values():
+    from sqlalchemy import event
+
+    strainer = Strainer(m.Customer)
+    strainer.relate('parent', m.Customer.parent)
+    names = sorted(set(n for n, in session.query(m.Customer.first_name)))
+    prefix = names[len(names) // 2][:1]
+    statements = []
+
+    def count(*args):
+        statements.append(args[2])
+
+    event.listen(session.bind, 'before_cursor_execute', count)
+    try:
+        assert(strainer.suggest(session, 'first_name', prefix, limit=100) == [n for n in names if n.startswith(prefix)])
+        assert(len(statements) == 1)
+        longer = names[len(names) // 2][:2]
+        assert(strainer.suggest(session, 'first_name', longer, limit=100) == [n for n in names if n.startswith(longer)])
+        assert(len(statements) == 1)
+        assert(strainer.suggest(session, 'first_name', '', limit=3) == names[:3])
+        assert(len(statements) == 2)
+        assert(strainer.suggest(session, 'first_name', names[3][:1], limit=3) is not None)
+        assert(len(statements) == 3)
+
+        cache = strainer._suggestions['first_name']
+        cache._clock = lambda: 1e12
+        strainer.suggest(session, 'first_name', prefix, limit=100)
+        assert(len(statements) == 4)
+
+        st, errors = strainer.build([{'name': 'parent.first_name', 'values': ['a']}])
+        scoped = strainer.suggest(session, 'customer_id', '1', strained=st)
+        ids = sorted(str(c.customer_id) for c in st.strain(session.query(m.Customer)))
+        assert(scoped == sorted(int(i) for i in ids if i.startswith('1'))[:10])
+
+        strainer.exclude('customer.details')
+        for hidden in ('details', 'view_only', 'nope'):
+            with pytest.raises(KeyError):
+                strainer.suggest(session, hidden, 'a')
+        assert(set(strainer._suggestions) == {'first_name', 'customer_id'})
+    finally:
+        event.remove(session.bind, 'before_cursor_execute', count)
+
+
+def test_anti_join():
+    value = session.query(m.Order.details).filter(m.Order.details != None).first()[0][:3].lower()
+    expected = sorted(c.customer_id for c in session.query(m.Customer)
+                      if not any(o.details and value in o.details.lower() for o in c.orders))
+    data = [{'name': 'orders.details', 'action': 'notcontains', 'values': [value]}]
+    for form in ('exists', 'outerjoin'):
+        strainer = Strainer(m.Customer)
+        strainer.anti_join = form
+        strainer.relate('orders', m.Customer.orders)
+        st, errors = strainer.build(data)
+        assert(not errors)
+        query = st.strain(session.query(m.Customer))
+        sql = str(query)
+        assert(('NOT (EXISTS' in sql) == (form == 'exists'))
+        assert(('LEFT OUTER JOIN' in sql and 'IS NULL' in sql) == (form == 'outerjoin'))
+        assert(sorted(c.customer_id for c in query) == expected)
+
+        st, errors = strainer.build([dict(data[0], not_=True)])
+        assert(sorted(c.customer_id for c in st.strain(session.query(m.Customer))) ==
+               sorted(c.customer_id for c in session.query(m.Customer)
+                      if any(o.details and value in o.details.lower() for o in c.orders)))
+
+    strainer = Strainer(m.Customer)
+    strainer.anti_join = None
+    strainer.relate('orders', m.Customer.orders)
+    st, errors = strainer.build(data)
+    legacy = set(c.customer_id for c in st.strain(session.query(m.Customer)))
+    assert(legacy == set(c.customer_id for c in session.query(m.Customer)
+                         if any(o.details and value not in o.details.lower() for o in c.orders)))
+
+
+def test_polymorphic_of_type():
+    from sqlalchemy import Column, Integer, String, ForeignKey
+    from sqlalchemy.ext.declarative import declarative_base
+    from sqlstrainer.mapper import StrainerMap
+
+    Fleet = declarative_base()
+
+    class Owner(Fleet):
+        __tablename__ = 'fleet_owner'
+        owner_id = Column(Integer, primary_key=True)
+        name = Column(String)
+
+    class Vehicle(Fleet):
+        __tablename__ = 'fleet_vehicle'
+        vehicle_id = Column(Integer, primary_key=True)
+        owner_id = Column(Integer, ForeignKey(Owner.owner_id))
+        kind = Column(String)
+        owner = orm.relationship(Owner, backref='vehicles')
+        __mapper_args__ = {'polymorphic_on': kind, 'polymorphic_identity': 'vehicle'}
+
+    class Car(Vehicle):
+        __tablename__ = 'fleet_car'
+        vehicle_id = Column(Integer, ForeignKey(Vehicle.vehicle_id), primary_key=True)
+        doors = Column(Integer)
+        __mapper_args__ = {'polymorphic_identity': 'car'}
+
+    class Truck(Vehicle):
+        __tablename__ = 'fleet_truck'
+        vehicle_id = Column(Integer, ForeignKey(Vehicle.vehicle_id), primary_key=True)
+        payload = Column(Integer)
+        __mapper_args__ = {'polymorphic_identity': 'truck'}
+
+    class Driver(Fleet):
+        __tablename__ = 'fleet_driver'
+        driver_id = Column(Integer, primary_key=True)
+        owner_id = Column(Integer, ForeignKey(Owner.owner_id))
+        kind = Column(String)
+        owner = orm.relationship(Owner, backref='drivers')
+        __mapper_args__ = {'polymorphic_on': kind, 'polymorphic_identity': 'driver'}
+
+    class Senior(Driver):
+        __mapper_args__ = {'polymorphic_identity': 'senior'}
+
+    dbmap = StrainerMap.for_base(Fleet)
+    vehicle = orm.class_mapper(Vehicle)
+    assert(dbmap.subtype(vehicle, 'car') is orm.class_mapper(Car))
+    assert(dbmap.subtype(vehicle, 'fleet_truck') is orm.class_mapper(Truck))
+    assert(dbmap.subtype(vehicle, Owner) is None)
+    driver = orm.class_mapper(Driver)
+    assert(dbmap.subtype(driver, 'fleet_driver') is driver)
+    assert(dbmap.subtype(driver, 'senior') is orm.class_mapper(Senior))
+    assert(None not in dbmap._subtypes[driver])
+    assert(dbmap.join_from_dotted('fleet_owner.drivers.fleet_driver') == [Owner.drivers])
+
+    engine = create_engine('sqlite:///:memory:')
+    Fleet.metadata.create_all(engine)
+    fleet = create_session(bind=engine)
+    fleet.add_all([Owner(owner_id=1, vehicles=[Car(doors=2), Truck(payload=9)]),
+                   Owner(owner_id=2, vehicles=[Car(doors=4)]),
+                   Owner(owner_id=3, vehicles=[Truck(payload=4)])])
+    fleet.flush()
+
+    strainer = Strainer(Owner, dbmap=dbmap)
+    strainer.relate('cars', 'vehicles.car')
+    strainer.relate('trucks', [Owner.vehicles, Truck])
+    st, errors = strainer.build([{'name': 'cars.doors', 'action': 'eq', 'values': [4]}])
+    assert(not errors)
+    query = st.strain(fleet.query(Owner))
+    assert('fleet_car' in str(query) and 'fleet_truck' not in str(query))
+    assert([o.owner_id for o in query] == [2])
+    st, errors = strainer.build([{'name': 'trucks.payload', 'action': 'lt', 'values': [5]}])
+    assert([o.owner_id for o in st.strain(fleet.query(Owner))] == [3])
+
+    fleet.add_all([Driver(owner_id=1), Senior(owner_id=2)])
+    fleet.flush()
+    strainer.relate('seniors', 'drivers.senior')
+    st, errors = strainer.build([{'name': 'seniors.driver_id', 'action': 'gt', 'values': [0]}])
+    assert([o.owner_id for o in st.strain(fleet.query(Owner))] == [2])
+
+
+def test_slow_filter_log():
+    from sqlstrainer.diagnostics import SlowFilterLog
+
+    engine = create_engine('sqlite:///:memory:')
+    m.Model.metadata.create_all(engine)
+    session = create_session(bind=engine)
+    # only cursor.execute is timed, which SQLite returns from before reading any row
+    slow = SlowFilterLog(threshold=0, maxsize=2)
+    slow.attach(engine)
+    strainer = Strainer(m.Customer)
+    strainer.relate('orders', m.Customer.orders)
+    strainer.diagnostics = slow
+    data = [{'name': 'first_name', 'values': ['a']}, {'name': 'orders.details', 'values': ['b', 'c']}]
+    first, errors = strainer.build(data)
+    first.strain(session.query(m.Customer)).all()
+    again, errors = strainer.build([dict(f, values=['x', 'y']) if f['name'] == 'orders.details' else f
+                                    for f in data])
+    again.strain(session.query(m.Customer)).all()
+    assert(first.fingerprint == again.fingerprint and len(slow) == 1)
+    entry = slow.get(strainer.base, first.fingerprint).as_dict()
+    assert(entry['count'] == 2 and entry['mapper'] == 'Customer')
+    assert('JOIN "order"' in entry['sql'] and entry['params'] == ['str', 'str', 'str'])
+    assert(any('customer' in str(row) for row in entry['plan']))
+
+    for name in ('last_name', 'gender'):
+        other, errors = strainer.build([{'name': name, 'values': ['a']}])
+        other.strain(session.query(m.Customer)).all()
+    assert(len(slow) == 2 and slow.get(strainer.base, first.fingerprint) is None)
+
+    parents = Strainer(m.Parent)
+    parents.diagnostics = slow
+    by_customer = strainer.build([{'name': 'first_name', 'values': ['a']}])[0]
+    by_parent = parents.build([{'name': 'first_name', 'values': ['a']}])[0]
+    by_customer.strain(session.query(m.Customer)).all()
+    by_parent.strain(session.query(m.Parent)).all()
+    assert(by_customer.fingerprint == by_parent.fingerprint)
+    assert(slow.get(parents.base, by_parent.fingerprint).as_dict()['mapper'] == 'Parent')
+    assert(slow.get(strainer.base, by_customer.fingerprint).as_dict()['mapper'] == 'Customer')
+
+    slow.threshold = 60
+    strainer.build([{'name': 'dob', 'action': 'lt', 'values': ['2000-01-01']}])[0].strain(
+        session.query(m.Customer)).all()
+    assert(len(slow) == 2)
+    engine.dispose()
+
+
+def test_golden_sql():
+    import golden
+
+    # flags are checked on fixed recordings, the plans SQLite picks vary by version
+    indexed = {'sql': ['SELECT customer.id FROM customer',
+                       'JOIN customer AS customer_1 ON customer_1.id = customer.parent_id'],
+               'plan': ['SCAN customer', 'SEARCH customer_1 USING INTEGER PRIMARY KEY (rowid=?)']}
+    scanned = {'sql': ['SELECT DISTINCT customer.id FROM customer',
+                       'JOIN customer AS customer_1 ON customer_1.id = customer.parent_id',
+                       'JOIN "order" ON customer.id = "order".customer_id'],
+               'plan': ['SCAN customer_1', 'SCAN customer', 'SEARCH order USING INDEX ix_order (customer_id=?)',
+                        'USE TEMP B-TREE FOR DISTINCT']}
+    assert(golden.flags(indexed, scanned) ==
+           ['joins added: 1 -> 2', 'DISTINCT added', 'scan replaced index search: customer_1',
+            'temp b-trees added: 0 -> 1'])
+    assert(golden.flags(scanned, indexed) == [])
+    assert(golden.flags({'sql': indexed['sql']}, {'sql': scanned['sql']}) ==
+           ['joins added: 1 -> 2', 'DISTINCT added'])
+
+    snapshot = golden.load()
+    if snapshot['versions']['sqlalchemy'] != golden.versions()['sqlalchemy']:
+        pytest.skip('golden SQL recorded with SQLAlchemy {0}'.format(snapshot['versions']['sqlalchemy']))
+    current = golden.snapshot()
+    changes = golden.review(snapshot, current)
+    assert not changes, golden.report(changes)
+
+    plans = current['plans']
+    changed = dict(current, plans=dict(plans, to_one=plans['base_and_relatives']))
+    name, found, diff = golden.review(snapshot, changed)[0]
+    assert(name == 'to_one' and found and diff.startswith('--- golden/to_one'))
@@ -0,0 +1,40 @@
+"""AsyncSession helpers, Python 3 only"""
+import pytest
+
+__author__ = 'Douglas MacDougall <douglas.macdougall@moesol.com>'
+
+from sqlstrainer.strainer import Strainer
+import models as m
+
+
+def test_aio_helpers(tmpdir):
+    pytest.importorskip('sqlalchemy.ext.asyncio')
+    pytest.importorskip('aiosqlite')
+    import asyncio
+    from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+    from sqlstrainer import aio
+
+    strainer = Strainer(m.Customer)
+    strainer.relate('parent', m.Customer.parent)
+    st, errors = strainer.build([{'name': 'parent.last_name', 'values': ['e']}])
+
+    async def run():
+        engine = create_async_engine('sqlite+aiosqlite:///' + str(tmpdir.join('aio.db')))
+        async with engine.begin() as conn:
+            await conn.run_sync(m.Model.metadata.create_all)
+        async with AsyncSession(engine) as s:
+            await s.run_sync(m.build_fake_data)
+            await s.commit()
+            expected = await s.run_sync(lambda sync: st.strain(sync.query(m.Customer)).count())
+            rows = await aio.fetch(s, st, limit=5)
+            total = await aio.count(s, st)
+            streamed = [c async for c in aio.stream(s, st, batch_size=10)]
+        page = await aio.page(engine, st, limit=3, facets=['gender'])
+        await engine.dispose()
+        return expected, rows, total, streamed, page
+
+    expected, rows, total, streamed, page = asyncio.run(run())
+    assert(total == expected == len(streamed))
+    assert(len(rows) == min(5, expected))
+    assert(page.total == total and len(page.items) == min(3, total))
+    assert(sum(n for _, n in page.facets['gender']) == total)